@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# pylint: disable=missing-docstring,invalid-name
+
+"""Analytical structural metrics of DCell networks, without building them in Mininet.
+
+DCellRouting paths without failures follow from index arithmetic on host ids, so the paths of
+batches of host pairs are enumerated level by level with NumPy. Pairs whose path passes a failed
+link are rerouted by DCellRouting itself (with its proxy nodes), which stays cheap as long as
+failures affect a small share of the pairs. For each DCell size the analysis reports the diameter
+and average length of DCellRouting paths, the bisection width and the number of paths passing
+each link.
+
+Path lengths count server hops as in the DCell paper: a hop through a mini switch or a level link
+counts as one.
+
+Usage: ./analysis.py [-s K,N ...] [-p NUM_PAIRS] [-f NUM_FAILED_LINKS]
+"""
+
+import argparse
+import logging
+import math
+import time
+
+import numpy as np
+
+import comm
+from routing import DCellRouting
+from wiring import DCellWiring
+
+# DCell sizes (k, n) to analyze by default
+DEFAULT_SIZES = [(1, 4), (2, 2), (2, 4), (3, 2), (3, 3)]
+
+# maximum number of host pairs whose paths are enumerated at once
+BATCH_SIZE = 1 << 16
+
+
+class DCellAnalysis(object):
+    """Enumerate DCellRouting paths of a DCell in vectorized batches and aggregate their metrics.
+
+    Links are indexed by id h*(k+1)+l for the 0-based host id h: l is 0 for the link between host
+    switch h and its mini switch, and l >= 1 for the level-l link of which h is the lower end.
+    """
+
+    def __init__(self, k, n):
+        self.k, self.n = k, n
+        self.num_hosts, self.num_switches = comm.count_nodes(k, n)
+        self.wiring = DCellWiring.build(k, n)
+
+        # number of hosts in a DCell_l for each level l
+        self._sizes = [comm.count_nodes(level, n)[0] for level in range(k + 1)]
+
+    def num_links(self):
+        """Get the number of links between switches."""
+        return len(self.wiring.links)
+
+    def link_ids(self, links):
+        """Convert (dpid1, dpid2) links with dpid1 < dpid2 to link ids."""
+        ids = []
+        for dpid1, dpid2 in links:
+            ports = self.wiring.level_ports[dpid1]
+            level = np.flatnonzero(np.asarray(self.wiring.peers[dpid1, ports]) == dpid2)[0]
+            ids.append((dpid1 - 1) * (self.k + 1) + int(level))
+        return np.array(ids, dtype=np.int64)
+
+    def link(self, link_id):
+        """Convert a link id to its (dpid1, dpid2) link with dpid1 < dpid2."""
+        dpid, level = link_id // (self.k + 1) + 1, link_id % (self.k + 1)
+        return dpid, int(self.wiring.peers[dpid, self.wiring.level_port(dpid, level)])
+
+    def routes(self, src, dst):
+        """Enumerate the DCellRouting paths of host pairs without failures.
+
+        Args:
+            src (numpy.ndarray): 0-based source host ids
+            dst (numpy.ndarray): 0-based destination host ids
+
+        Returns:
+            lengths (numpy.ndarray): number of server hops of each path
+            pairs (numpy.ndarray): index of the host pair of each link passed
+            link_ids (numpy.ndarray): id of each link passed, along with pairs
+        """
+        pair_parts, link_parts, hop_parts = [], [], []
+        self._walk(src, dst, np.arange(len(src)), self.k, pair_parts, link_parts, hop_parts)
+        lengths = np.bincount(np.concatenate(hop_parts + [np.empty(0, np.int64)]),
+                              minlength=len(src))
+        return (lengths, np.concatenate(pair_parts + [np.empty(0, np.int64)]),
+                np.concatenate(link_parts + [np.empty(0, np.int64)]))
+
+    def _walk(self, src, dst, pair, level, pair_parts, link_parts, hop_parts):
+        """DCellRouting(src, dst) within DCell_levels on arrays of host pairs."""
+        if len(src) == 0:
+            return
+        if level == 0:  # hop through the mini switch
+            moved = src != dst
+            pair = pair[moved]
+            pair_parts.extend((pair, pair))
+            link_parts.extend((src[moved] * (self.k + 1), dst[moved] * (self.k + 1)))
+            hop_parts.append(pair)
+            return
+
+        sub_size = self._sizes[level - 1]
+        src_idx, dst_idx = (src // sub_size) % (sub_size + 1), (dst // sub_size) % (sub_size + 1)
+        same = src_idx == dst_idx
+        self._walk(src[same], dst[same], pair[same], level - 1, pair_parts, link_parts, hop_parts)
+
+        # the middle link connects host j-1 of sub DCell i and host i of sub DCell j (i < j)
+        diff = ~same
+        src, dst, pair, src_idx, dst_idx = src[diff], dst[diff], pair[diff], src_idx[diff], \
+            dst_idx[diff]
+        base = src - src % (sub_size * (sub_size + 1))
+        lower = src_idx < dst_idx
+        mid_src = base + src_idx * sub_size + np.where(lower, dst_idx - 1, dst_idx)
+        mid_dst = base + dst_idx * sub_size + np.where(lower, src_idx, src_idx - 1)
+        pair_parts.append(pair)
+        link_parts.append(np.minimum(mid_src, mid_dst) * (self.k + 1) + level)
+        hop_parts.append(pair)
+        self._walk(src, mid_src, pair, level - 1, pair_parts, link_parts, hop_parts)
+        self._walk(mid_dst, dst, pair, level - 1, pair_parts, link_parts, hop_parts)
+
+    def analyze(self, num_pairs=None, failed_links=(), rng=None):
+        """Compute the path and link metrics of the DCell.
+
+        Args:
+            num_pairs (int): number of host pairs sampled uniformly, all ordered pairs if None
+            failed_links (iterable): failed (dpid1, dpid2) links with dpid1 < dpid2
+            rng (numpy.random.RandomState): random generator sampling host pairs
+
+        Returns:
+            metrics (dict): metrics of the paths found and links passed
+        """
+        failed = np.zeros(self.num_hosts * (self.k + 1), dtype=bool)
+        failed[self.link_ids(failed_links)] = True
+        routing = None
+        if failed.any():
+            comm.DCELL_K, comm.DCELL_N = self.k, self.n
+            routing = DCellRouting(set(failed_links), wiring=self.wiring)
+
+        loads = np.zeros(self.num_hosts * (self.k + 1), dtype=np.int64)
+        length_counts = np.zeros(1, dtype=np.int64)
+        num_rerouted, num_unreachable = 0, 0
+        for src, dst in self._pairs(num_pairs, rng):
+            lengths, pairs, link_ids = self.routes(src, dst)
+            if routing is not None:
+                affected = np.unique(pairs[failed[link_ids]])
+                kept = np.ones(len(src), dtype=bool)
+                kept[affected] = False
+                length_parts, link_parts = [lengths[kept]], [link_ids[kept[pairs]]]
+                num_rerouted += len(affected)
+                for idx in affected:
+                    reroute = self._reroute(routing, src[idx], dst[idx])
+                    if reroute is None:
+                        num_unreachable += 1
+                        continue
+                    length_parts.append(np.array([reroute[0]]))
+                    link_parts.append(reroute[1])
+                lengths, link_ids = np.concatenate(length_parts), np.concatenate(link_parts)
+
+            # rerouted paths may be longer than all paths counted so far
+            counts = np.bincount(lengths, minlength=len(length_counts))
+            counts[:len(length_counts)] += length_counts
+            length_counts = counts
+            loads += np.bincount(link_ids, minlength=len(loads))
+
+        lengths = np.flatnonzero(length_counts)
+        num_routes = length_counts.sum()
+        link_ids = self._all_link_ids()
+        link_ids = link_ids[~failed[link_ids]]
+        metrics = {
+            "hosts": self.num_hosts,
+            "switches": self.num_switches,
+            "links": self.num_links(),
+            "pairs": num_routes + num_unreachable,
+            "rerouted": num_rerouted,
+            "unreachable": num_unreachable,
+            "diameter": int(lengths[-1]) if len(lengths) else 0,
+            "diameter_bound": (1 << (self.k + 1)) - 1,
+            "avg_length": float(length_counts.dot(np.arange(len(length_counts)))) /
+                          max(num_routes, 1),
+            "bisection": self.bisection_cut(),
+            "bisection_bound": self.bisection_bound(),
+            "max_load": int(loads[link_ids].max()),
+            "avg_load": float(loads[link_ids].mean()),
+            "level_max_loads": [int(loads[link_ids[link_ids % (self.k + 1) == level]].max())
+                                for level in range(self.k + 1)],
+        }
+        return metrics
+
+    def bisection_cut(self):
+        """Get the number of level-k links cut by splitting the DCell_(k-1)s into two halves.
+
+        Every DCell_(k-1) is connected internally, so this is the smallest cut between two halves
+        made of whole DCell_(k-1)s, and thus an upper bound of the bisection width.
+        """
+        if self.k == 0:
+            return self.n / 2  # mini switch links of one half
+        num_dcells = comm.count_dcells(self.k, self.n)
+        return (num_dcells / 2) * (num_dcells - num_dcells / 2)
+
+    def bisection_bound(self):
+        """Get the lower bound N/(4 log_n N) of the bisection width from the DCell paper."""
+        if self.n < 2 or self.num_hosts < 2:
+            return 0.0
+        return self.num_hosts / (4 * math.log(self.num_hosts, self.n))
+
+    def _all_link_ids(self):
+        """Get the ids of all links between switches."""
+        links = np.asarray(self.wiring.links, dtype=np.int64)
+        levels = (self.wiring.level_ports[links[:, 0]] == links[:, 1:2]).argmax(axis=1)
+        return (np.minimum(links[:, 0], links[:, 2]) - 1) * (self.k + 1) + levels
+
+    def _pairs(self, num_pairs, rng):
+        """Iterate over batches of (src, dst) arrays of 0-based host ids, src != dst."""
+        if num_pairs is None:  # all ordered pairs, a block of sources at a time
+            block = max(BATCH_SIZE / self.num_hosts, 1)
+            for first in range(0, self.num_hosts, block):
+                src = np.repeat(np.arange(first, min(first + block, self.num_hosts)),
+                                self.num_hosts)
+                dst = np.tile(np.arange(self.num_hosts), len(src) / self.num_hosts)
+                yield src[src != dst], dst[src != dst]
+            return
+
+        rng = np.random.RandomState() if rng is None else rng
+        for first in range(0, num_pairs, BATCH_SIZE):
+            size = min(BATCH_SIZE, num_pairs - first)
+            src = rng.randint(0, self.num_hosts, size)
+            dst = (src + rng.randint(1, self.num_hosts, size)) % self.num_hosts
+            yield src, dst
+
+    def _reroute(self, routing, src, dst):
+        """Get (length, link_ids) of the path DCellRouting takes around failed links, or None."""
+        hops = routing.route(comm.tuple_id(src + 1), comm.tuple_id(dst + 1))
+        if hops is None:
+            return None
+        dpids = [dpid for dpid, _ in hops]
+        length = sum(1 for dpid in dpids if dpid <= self.num_hosts) - 1
+        links = [(min(dpid1, dpid2), max(dpid1, dpid2)) for dpid1, dpid2 in zip(dpids, dpids[1:])]
+        return length, self.link_ids(links)
+
+
+def sample_failed_links(analysis, num_links, rng):
+    """Sample failed links among all links between switches."""
+    links = analysis.wiring.links
+    rows = rng.choice(len(links), min(num_links, len(links)), replace=False)
+    return [(min(dpid1, dpid2), max(dpid1, dpid2)) for dpid1, _, dpid2, _ in links[rows].tolist()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analytical DCell structural metrics.")
+    parser.add_argument("-s", "--sizes", nargs="+", metavar="K,N",
+                        help="DCell sizes to analyze (default: {})".format(
+                            " ".join("{},{}".format(k, n) for k, n in DEFAULT_SIZES)))
+    parser.add_argument("-p", "--pairs", type=int,
+                        help="number of sampled host pairs (default: all ordered pairs)")
+    parser.add_argument("-f", "--failed-links", type=int, default=0,
+                        help="number of sampled links to fail (default: 0)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for sampling pairs and links")
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    sizes = DEFAULT_SIZES
+    if args.sizes:
+        sizes = [tuple(int(val) for val in size.split(",")) for size in args.sizes]
+
+    rng = np.random.RandomState(args.seed)
+    print "{:>2} {:>2} {:>8} {:>8} {:>10} {:>8} {:>8} {:>7} {:>10} {:>9} {:>9} {:>7}".format(
+        "k", "n", "hosts", "links", "pairs", "unreach", "diameter", "avg_len", "bisection",
+        "max_load", "avg_load", "time(s)")
+    for k, n in sizes:
+        start = time.time()
+        analysis = DCellAnalysis(k, n)
+        failed_links = sample_failed_links(analysis, args.failed_links, rng)
+        metrics = analysis.analyze(args.pairs, failed_links, rng)
+        print ("{:>2d} {:>2d} {:>8d} {:>8d} {:>10d} {:>8d} {:>4d}/{:<3d} {:>7.3f} {:>4d}/{:<5.1f} "
+               "{:>9d} {:>9.1f} {:>7.2f}").format(
+                   k, n, metrics["hosts"], metrics["links"], metrics["pairs"],
+                   metrics["unreachable"], metrics["diameter"], metrics["diameter_bound"],
+                   metrics["avg_length"], metrics["bisection"], metrics["bisection_bound"],
+                   metrics["max_load"], metrics["avg_load"], time.time() - start)
+
+
+if __name__ == "__main__":
+    main()
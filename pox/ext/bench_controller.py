@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# pylint: disable=missing-docstring,invalid-name
+
+"""Offline benchmarks of route computation in the DCell controller.
+
+The controller runs against mock OpenFlow connections that only count and size the messages they
+receive, so no Mininet network, Open vSwitch or root privilege is needed. For each DCell size the
+benchmark connects all switches (building all routes), then breaks and recovers sampled links one
+by one, reporting the time spent and the messages sent to the switches.
+
+Usage: ./bench_controller.py [-s K,N ...] [-l NUM_LINKS] [--set NAME=VALUE ...]
+"""
+
+import argparse
+import ast
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pox.core
+pox.core.initialize()
+from pox.core import core
+from pox.openflow import ConnectionUp
+from pox.openflow.discovery import Link, LinkEvent
+
+import comm
+import dcell_controller
+from mock_openflow import MockConnection, MockOpenFlow
+from wiring import DCellWiring
+
+# DCell sizes (k, n) to benchmark by default
+DEFAULT_SIZES = [(1, 4), (1, 8), (2, 2), (2, 3)]
+
+
+class Stats(object):
+    """Time and messages of one benchmarked operation, accumulated over its runs."""
+
+    def __init__(self, openflow, controller):
+        self._openflow = openflow
+        self._controller = controller
+        self.runs = 0
+        self.time = 0.0
+        self.sends = self.msgs = self.bytes = 0
+
+    def measure(self, func, *args):
+        counters = self._openflow.counters()
+        start = time.time()
+        func(*args)
+        while self._controller._route_tasks:
+            time.sleep(0.001)  # routes still computed by worker processes
+        self.time += time.time() - start
+        sends, msgs, num_bytes = [after - before for before, after
+                                  in zip(counters, self._openflow.counters())]
+        self.sends += sends
+        self.msgs += msgs
+        self.bytes += num_bytes
+        self.runs += 1
+
+    def row(self):
+        runs = max(self.runs, 1)
+        return "{:>9.3f} {:>8d} {:>8d} {:>10d}".format(
+            self.time / runs, self.sends / runs, self.msgs / runs, self.bytes / runs)
+
+
+def sample_links(num_links, rng):
+    """Sample links of the DCell as (dpid1, port1, dpid2, port2) tuples."""
+    wiring = DCellWiring.load_or_build()
+
+    # host switch ports connected to the mini switch and the level links
+    ports = [(dpid, port) for dpid in range(1, wiring.num_hosts + 1)
+             for port in range(1, wiring.peers.shape[1]) if wiring.peers[dpid, port]]
+    links = []
+    for dpid, port in rng.sample(ports, min(num_links, len(ports))):
+        peer, peer_port = wiring.peer(dpid, port)
+        links.append(Link(dpid, port, peer, peer_port).uni)
+    return links
+
+
+def bench(k, n, num_links, rng):
+    """Benchmark the controller on a DCell_k with n hosts in each DCell_0."""
+    comm.DCELL_K, comm.DCELL_N = k, n
+    num_hosts, num_switches = comm.count_nodes()
+
+    # replace the openflow component (registered again for each size)
+    openflow = MockOpenFlow()
+    core.components["openflow"] = openflow
+    controller = dcell_controller.Controller()
+
+    def connect_all():
+        for dpid in range(1, num_switches + 1):
+            conn = openflow.connections[dpid] = MockConnection(dpid)
+            controller._handle_openflow_ConnectionUp(ConnectionUp(conn, None))
+
+    build, fail, recover = [Stats(openflow, controller) for _ in range(3)]
+    build.measure(connect_all)
+    for link in sample_links(num_links, rng):
+        fail.measure(controller._handle_openflow_discovery_LinkEvent, LinkEvent(False, link))
+        recover.measure(controller._handle_openflow_discovery_LinkEvent, LinkEvent(True, link))
+
+    print "{:>2d} {:>2d} {:>6d} {:>8d} | {} | {} | {}".format(
+        k, n, num_hosts, num_hosts * (num_hosts - 1), build.row(), fail.row(), recover.row())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline DCell controller benchmarks.")
+    parser.add_argument("-s", "--sizes", nargs="+", metavar="K,N",
+                        help="DCell sizes to benchmark (default: {})".format(
+                            " ".join("{},{}".format(k, n) for k, n in DEFAULT_SIZES)))
+    parser.add_argument("-l", "--links", type=int, default=10,
+                        help="number of sampled links to break and recover (default: 10)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for sampling links")
+    parser.add_argument("--set", nargs="+", default=[], metavar="NAME=VALUE",
+                        help="override comm configurations by Python literals, e.g. AGGREGATE_FLOWS=True")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show controller logs")
+    args = parser.parse_args()
+
+    # rebuild routes synchronously on each link event to measure them, without audits
+    comm.LINK_EVENT_WINDOW = 0
+    comm.AUDIT_INTERVAL = 0
+
+    sizes = DEFAULT_SIZES
+    if args.sizes:
+        sizes = [tuple(int(val) for val in size.split(",")) for size in args.sizes]
+    for option in args.set:
+        name, _, value = option.partition("=")
+        if not name.isupper() or not hasattr(comm, name):
+            parser.error("unknown configuration: {}".format(name))
+        try:
+            setattr(comm, name, ast.literal_eval(value))
+        except (SyntaxError, ValueError):
+            parser.error("invalid value of {}: {}".format(name, value))
+    if not args.verbose:
+        logging.disable(logging.ERROR)
+
+    # core.quit() only goes down (raising GoingDownEvent) once core is up
+    core.goUp()
+
+    rng = random.Random(args.seed)
+    columns = "{:>9} {:>8} {:>8} {:>10}".format("time(s)", "sends", "msgs", "bytes")
+    print "{:>2} {:>2} {:>6} {:>8} | {:^37} | {:^37} | {:^37}".format(
+        "", "", "", "", "build_all_routes", "link failure (avg)", "link recovery (avg)")
+    print "{:>2} {:>2} {:>6} {:>8} | {} | {} | {}".format(
+        "k", "n", "hosts", "routes", columns, columns, columns)
+    for k, n in sizes:
+        bench(k, n, args.links, rng)
+
+    core.quit()  # stop POX threads and worker processes, see main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# pylint: disable=missing-docstring,invalid-name
+
+"""Flow-level simulation of the network capacity test.
+
+Instead of running iperf flows in Mininet, each flow is assigned the path the controller would
+install and the max-min fair rates of all active flows are computed by progressive filling over
+the directed links they pass. The simulation jumps from one flow completion to the next, so the
+aggregated throughput over time of the DCell and tree networks is obtained in seconds, also for
+networks far larger than Mininet can host.
+
+The link-flow incidence matrix is kept sparse as (flow, link) index arrays, multiplied with
+vectors by np.bincount.
+
+Usage: ./capacity_sim.py [-s K,N] [-d DATA_SIZE_MB] [-r]
+"""
+
+import argparse
+import logging
+import os
+import time
+
+import matplotlib
+matplotlib.use("Agg")  # do not use any Xwindows backend
+import matplotlib.pyplot as plt
+import numpy as np
+
+import comm
+from routing import DCellRouting
+from wiring import DCellWiring
+
+# data size of each flow (MBytes), as sent by "iperf -n 250M" in the network capacity test
+DATA_SIZE = 250
+
+# relative tolerance of remaining capacities treated as saturated
+EPSILON = 1e-9
+
+# flows completing within this window (seconds) after the next completion complete along with it,
+# so that rates are recomputed less often at the cost of finishing these flows slightly early
+COMPLETION_WINDOW = 0.1
+
+
+def dcell_routes(pairs):
+    """Get the paths the DCell controller installs for host pairs.
+
+    Returns:
+        paths (list): directed links passed by each path: (-host_id, 0) for the link from the
+            source host to its host switch, then (dpid, out_port) of each switch on the path
+    """
+    routing = DCellRouting(set(), wiring=DCellWiring.build())
+    paths = []
+    for src, dst in pairs:
+        hops = routing.route(comm.tuple_id(src), comm.tuple_id(dst))
+        paths.append(((-src, 0),) + hops)
+    return paths
+
+
+def tree_routes(pairs, rack_size):
+    """Get the paths the tree controller learns for host pairs in a two-level tree.
+
+    The tree has one top switch connecting racks of rack_size hosts, as built by DCellTopo for the
+    tree topology: the switch of rack r connects the top switch on port 1 and its i-th host on port
+    i+2, the top switch connects rack r on port r+1.
+
+    Returns:
+        paths (list): directed links passed by each path, see dcell_routes()
+    """
+    num_racks = (max(max(pair) for pair in pairs) - 1) / rack_size + 1
+    top = num_racks + 1
+    paths = []
+    for src, dst in pairs:
+        rack_src, rack_dst = (src - 1) / rack_size + 1, (dst - 1) / rack_size + 1
+        path = [(-src, 0)]
+        if rack_src != rack_dst:
+            path.extend(((rack_src, 1), (top, rack_dst + 1)))
+        path.append((rack_dst, (dst - 1) % rack_size + 2))
+        paths.append(tuple(path))
+    return paths
+
+
+def max_min_rates(flows, links, capacities, num_flows):
+    """Compute max-min fair rates of flows by progressive filling.
+
+    All flows not limited yet increase their rates equally until a link saturates, then the flows
+    passing the saturated link are frozen, until all flows are frozen.
+
+    Args:
+        flows (numpy.ndarray): flow index of each nonzero entry of the link-flow incidence matrix
+        links (numpy.ndarray): link index of each nonzero entry, along with flows
+        capacities (numpy.ndarray): capacity of each link
+        num_flows (int): number of flows
+
+    Returns:
+        rates (numpy.ndarray): rate of each flow
+    """
+    used, links = np.unique(links, return_inverse=True)
+    capacities = capacities[used]
+    remaining = capacities.astype(float)
+    rates = np.zeros(num_flows)
+    frozen = np.zeros(num_flows, dtype=bool)
+    level = 0.0  # rate of the flows not frozen yet
+    while len(flows):
+        counts = np.bincount(links, minlength=len(remaining))
+        used = counts > 0
+        delta = (remaining[used] / counts[used]).min()
+        level += delta
+        remaining -= delta * counts
+
+        # freeze the flows passing saturated links and drop their entries
+        saturated = remaining <= EPSILON * capacities
+        frozen_flows = flows[saturated[links]]
+        rates[frozen_flows] = level
+        frozen[frozen_flows] = True
+        kept = ~frozen[flows]
+        flows, links = flows[kept], links[kept]
+    return rates
+
+
+def simulate(paths, data_size, link_bw):
+    """Simulate flows sending data_size MBytes each along given paths, all starting at time 0.
+
+    Returns:
+        throughputs (list): aggregated throughput (Mbps) in each second, ended by a 0 as in the
+            network capacity test
+        finish (float): completion time (seconds) of the last flow
+    """
+    link_index = {}
+    flows, links = [], []
+    for flow, path in enumerate(paths):
+        for link in path:
+            flows.append(flow)
+            links.append(link_index.setdefault(link, len(link_index)))
+    flows, links = np.array(flows, dtype=np.int64), np.array(links, dtype=np.int64)
+    capacities = np.full(len(link_index), float(link_bw))
+
+    remaining = np.full(len(paths), data_size * 8 * 1.048576)  # Mbits, as iperf "-n 250M"
+    alive = np.ones(len(paths), dtype=bool)
+    now, bins = 0.0, [0.0]
+    while alive.any():
+        # rates of the alive flows, reindexed to keep the incidence matrix small
+        entries = alive[flows]
+        ids = np.flatnonzero(alive)
+        index = np.zeros(len(paths), dtype=np.int64)
+        index[ids] = np.arange(len(ids))
+        rates = max_min_rates(index[flows[entries]], links[entries], capacities, len(ids))
+
+        # advance to the next completion, finishing all flows within the completion window
+        times = remaining[ids] / rates
+        step = times.min()
+        done = times <= step + COMPLETION_WINDOW
+        remaining[ids] -= rates * step
+        remaining[ids[done]] = 0
+        alive[ids[done]] = False
+
+        # spread the data sent during the step over one second bins
+        total, end = rates.sum(), now + step
+        while now < end - EPSILON:
+            second = int(now + EPSILON)
+            if second >= len(bins):
+                bins.append(0.0)
+            until = min(end, second + 1)
+            bins[second] += total * (until - now)
+            now = until
+        now = end
+
+    return bins + [0], now
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flow-level DCell network capacity simulation.")
+    parser.add_argument("-s", "--size", metavar="K,N",
+                        help="DCell size to simulate (default: {},{})".format(
+                            comm.DCELL_K, comm.DCELL_N))
+    parser.add_argument("-d", "--data-size", type=float, default=DATA_SIZE,
+                        help="data size of each flow in MBytes (default: {})".format(DATA_SIZE))
+    parser.add_argument("-r", "--random", action="store_true",
+                        help="each host sends to one random other host instead of all others")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random destinations")
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    if args.size:
+        comm.DCELL_K, comm.DCELL_N = (int(val) for val in args.size.split(","))
+    num_hosts, _ = comm.count_nodes()
+
+    # traffic matrix
+    hosts = np.arange(1, num_hosts + 1)
+    if args.random:
+        rng = np.random.RandomState(args.seed)
+        dsts = (hosts + rng.randint(1, num_hosts, num_hosts) - 1) % num_hosts + 1
+        pairs = zip(hosts.tolist(), dsts.tolist())
+    else:
+        pairs = [(src, dst) for src in hosts.tolist() for dst in hosts.tolist() if src != dst]
+
+    results = []
+    for name, color, routes in (("DCell", "r", dcell_routes),
+                                ("Tree", "g", lambda pairs: tree_routes(pairs, comm.DCELL_N))):
+        start = time.time()
+        throughputs, finish = simulate(routes(pairs), args.data_size, comm.LINK_BW)
+        print "{:<5} | hosts={} | flows={} | finish={:.1f}s | peak={:.1f}Mbps | time={:.2f}s" \
+            .format(name, num_hosts, len(pairs), finish, max(throughputs), time.time() - start)
+        results.append((name, color, throughputs))
+
+    # build figure
+    if not os.path.exists(comm.DIR_FIGURE):
+        os.mkdir(comm.DIR_FIGURE)
+    for name, color, throughputs in results:
+        plt.plot(range(len(throughputs)), throughputs, color, label=name)
+    plt.legend(loc="upper right")
+    plt.title("Network Capacity Simulation")
+    plt.xlabel("Time (second)")
+    plt.ylabel("Aggregated Throughput (Mb/s)")
+    plt.savefig(os.path.join(comm.DIR_FIGURE, "network_capacity_sim.png"))
+    plt.clf()
+
+
+if __name__ == "__main__":
+    main()
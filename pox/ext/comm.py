@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # pylint: disable=missing-docstring,invalid-name
 
+import numpy as np
 from mininet.node import OVSKernelSwitch
 
 # whether run POX in debug mode
@@ -15,6 +16,89 @@ LINK_BW = 100
 # data link heartbeat timeout (seconds)
 # note: setting too low might falsely consider a good link failed, thus trigger routes rebuild
 LINK_TIMEOUT = 1
+# window (seconds) collecting link state changes before rebuilding affected routes once against the
+# final link states, 0 to rebuild routes on each link event
+# note: delays every failover by up to the window (e.g. 0.1), in exchange for one rebuild when
+# several links change at once
+LINK_EVENT_WINDOW = 0
+# link flap damping: the penalty of a link increases by 1 each time the link goes down and halves
+# every LINK_FLAP_HALF_LIFE seconds, a recovered link is not used while its penalty is above
+# LINK_FLAP_SUPPRESS, until the penalty decays to LINK_FLAP_REUSE, 0 to disable damping
+# note: a link recovering after its 4th failure in a row is unused for 2 half lives (e.g. 15)
+LINK_FLAP_HALF_LIFE = 0
+LINK_FLAP_SUPPRESS = 3
+LINK_FLAP_REUSE = 1
+
+# whether install destination-aggregated flow entries (matching only the destination MAC address)
+# instead of one flow entry per host pair, per-pair flow entries are then only installed where a
+# route detours from the aggregated one (e.g. through a proxy node)
+AGGREGATE_FLOWS = False
+
+# whether pre-install backup paths around each level link of a route, the backup paths take over
+# as soon as a switch reports its port down, without waiting for LINK_TIMEOUT and rebuilding routes
+BACKUP_FLOWS = False
+
+# whether install routes on demand when the first packet of a host pair reaches the controller,
+# instead of installing routes for all host pairs once all switches are connected
+REACTIVE_ROUTING = False
+# idle timeout (seconds) of flow entries installed on demand
+FLOW_IDLE_TIMEOUT = 10
+
+# whether spread TCP/UDP flows of each host pair over multiple paths (the DCellRouting path and
+# paths through proxy nodes) by hashing their 5-tuple, per-flow entries are installed on demand
+MULTIPATH_ROUTING = False
+# maximum number of paths for each host pair in multipath routing
+MULTIPATH_NUM_PATHS = 4
+
+# number of worker processes computing routes when many routes are built at once (e.g. while
+# switches connect), 0 to compute routes in the controller process
+ROUTE_WORKERS = 0
+
+# file of the controller state snapshot (flow entries and broken links) for warm restarts, None to
+# disable snapshots
+SNAPSHOT_FILE = None
+
+# interval (seconds) of writing the snapshot if the controller state changed
+SNAPSHOT_INTERVAL = 5
+
+# interval (seconds) of auditing the flow entries of a few switches against their flow stats, 0
+# to disable audits
+AUDIT_INTERVAL = 0
+
+# maximum number of switches audited at a time
+AUDIT_SWITCHES = 4
+
+# select the proxy node whose middle links are least loaded (measured by polling port stats)
+# instead of the first one found
+LOAD_AWARE_PROXY = False
+
+# interval (seconds) of polling port stats of a few host switches for link loads
+PORT_STATS_INTERVAL = 1
+
+# maximum number of port stats requests outstanding at a time
+PORT_STATS_REQUESTS = 8
+
+# weight of the newest sample in the exponentially-weighted link utilization
+LOAD_EWMA_WEIGHT = 0.3
+
+# utilization added to the middle links of a selected proxy node until the next port stats reply
+PROXY_LOAD_ESTIMATE = 0.1
+
+# answer ARP requests of hosts with a flow entry in their host switches (requires Nicira extension
+# actions, e.g. Open vSwitch) instead of sending them to the controller
+ARP_FLOWS = False
+
+# log a structured trace record of one in every ROUTE_TRACE_SAMPLE route builds on average to the
+# dcell_trace logger (0 to disable), cheap enough to be left enabled in production
+ROUTE_TRACE_SAMPLE = 0
+
+# file of the DCell wiring saved by the Mininet topology and memory-mapped by the controller at
+# launch, None to let the controller compute the wiring itself
+TOPO_FILE = "/tmp/dcell_topo.bin"
+
+# marker file created by the controller once all switches are connected and all flow entries
+# sent to them are acknowledged by barrier replies, removed when the controller starts
+ROUTES_READY_FILE = "/tmp/dcell_routes_ready"
 
 # directory to store test result figures
 DIR_FIGURE = "../../figures"
@@ -50,17 +134,18 @@ def ip_to_mac(ip):
     return mac_to_str(ip_int - IP_BASE)
 
 
-def count_nodes(k=DCELL_K, n=DCELL_N):
+def count_nodes(k=None, n=None):
     """Count total number of hosts and switches in a given DCell.
 
     Args:
-        k (int): Level of DCell to calculate
-        n (int): Number of hosts in a DCell_0
+        k (int): Level of DCell to calculate, DCELL_K if None
+        n (int): Number of hosts in a DCell_0, DCELL_N if None
 
     Returns:
         num_hosts (int): number of hosts in the DCell
         num_switches (int): number of switches in the DCell
     """
+    k, n = _resolve(k, n)
     num_hosts, num_switches = n, 1
 
     if k > 0:
@@ -74,16 +159,17 @@ def count_nodes(k=DCELL_K, n=DCELL_N):
     return num_hosts, num_switches
 
 
-def count_dcells(k=DCELL_K, n=DCELL_N):
+def count_dcells(k=None, n=None):
     """Count number of DCell_(k-1) in a given DCell.
 
     Args:
-        k (int): Level of DCell to calculate
-        n (int): Number of hosts in a DCell_0
+        k (int): Level of DCell to calculate, DCELL_K if None
+        n (int): Number of hosts in a DCell_0, DCELL_N if None
 
     Returns:
         num_dcells (int): number of DCell_(k-1) in the DCell
     """
+    k, n = _resolve(k, n)
     num_dcells, num_hosts = 1, n
     for _ in range(k):
         num_dcells = num_hosts + 1
@@ -91,51 +177,128 @@ def count_dcells(k=DCELL_K, n=DCELL_N):
     return num_dcells
 
 
-def tuple_id(host_id, k=DCELL_K, n=DCELL_N):
+def tuple_id(host_id, k=None, n=None):
     """Convert host id to its equivalent k+1 tuple representation.
 
     Args:
         host_id (int): Host id within range [1, num_hosts]
-        k (int): Level of DCell to calculate
-        n (int): Number of hosts in a DCell_0
+        k (int): Level of DCell to calculate, DCELL_K if None
+        n (int): Number of hosts in a DCell_0, DCELL_N if None
 
     Returns:
         tuple_id (list): k+1 tuple representation of the host id
     """
-    num_dcells = [1,] * (k + 1)
-    num_hosts = [n,] * (k + 1)
-    for i in range(k - 1, -1, -1):
-        num_dcells[i] = num_hosts[i + 1] + 1
-        num_hosts[i] = num_dcells[i] * num_hosts[i + 1]
-
-    tuple_id = [0,] * (k + 1)
     host_id -= 1
-    for i in range(k + 1):
-        if i == k:
-            tuple_id[i] = host_id % num_hosts[i]
-        else:
-            tuple_id[i] = host_id / num_hosts[i + 1]
-            host_id %= num_hosts[i + 1]
-
+    tuple_id = []
+    for radix in radix_table(k, n):
+        tuple_id.append(host_id / radix)
+        host_id %= radix
     return tuple_id
 
 
-def host_id(tuple_id, k=DCELL_K, n=DCELL_N):
+def host_id(tuple_id, k=None, n=None):
     """Convert k+1 tuple id to its equivalent host id.
 
     Args:
         tuple_id (list): k+1 tuple representation of the host id
-        k (int): Level of DCell to calculate
-        n (int): Number of hosts in a DCell_0
+        k (int): Level of DCell to calculate, DCELL_K if None
+        n (int): Number of hosts in a DCell_0, DCELL_N if None
 
     Returns:
         host_id (int): Host id (within range [1, num_hosts]) corresponding to the k+1 tuple id
     """
     host_id = 0
-    for i in range(k, -1, -1):
-        if i == k:
-            host_id += tuple_id[i]
-        else:
-            host_id += tuple_id[i] * n
-            n *= n + 1
+    for entry, radix in zip(tuple_id, radix_table(k, n)):
+        host_id += entry * radix
     return host_id + 1
+
+
+def tuple_ids(host_ids, k=None, n=None):
+    """Convert an array of host ids to their k+1 tuple representations in one call.
+
+    Args:
+        host_ids (array_like): Host ids within range [1, num_hosts]
+        k (int): Level of DCell to calculate, DCELL_K if None
+        n (int): Number of hosts in a DCell_0, DCELL_N if None
+
+    Returns:
+        tuple_ids (numpy.ndarray): (len(host_ids), k+1) matrix, one k+1 tuple id per row
+    """
+    radix = np.array(radix_table(k, n), dtype=np.int64)
+    tuple_ids = (np.asarray(host_ids, dtype=np.int64)[:, np.newaxis] - 1) // radix
+    # remove the higher entries, each radix is a multiple of the next one
+    tuple_ids[:, 1:] -= tuple_ids[:, :-1] * (radix[:-1] // radix[1:])
+    return tuple_ids
+
+
+def host_ids(tuple_ids, k=None, n=None):
+    """Convert a matrix of k+1 tuple ids (one per row) to their host ids in one call.
+
+    Args:
+        tuple_ids (array_like): (num_ids, k+1) matrix of k+1 tuple ids
+        k (int): Level of DCell to calculate, DCELL_K if None
+        n (int): Number of hosts in a DCell_0, DCELL_N if None
+
+    Returns:
+        host_ids (numpy.ndarray): host ids (within range [1, num_hosts]) of the k+1 tuple ids
+    """
+    radix = np.array(radix_table(k, n), dtype=np.int64)
+    return np.asarray(tuple_ids, dtype=np.int64).dot(radix) + 1
+
+
+def level_links(level, k=None, n=None):
+    """Get the links connecting the DCell_(level-1)s of each DCell_level in a given DCell.
+
+    DCell_(level-1) i and j (i < j) of a DCell_level are connected by a link between host j-1 of
+    DCell_(level-1) i and host i of DCell_(level-1) j, so the links follow from index arithmetic.
+
+    Args:
+        level (int): Level of the links within range [1, k]
+        k (int): Level of DCell to calculate, DCELL_K if None
+        n (int): Number of hosts in a DCell_0, DCELL_N if None
+
+    Returns:
+        links (numpy.ndarray): (num_links, 2) matrix, host ids of the two ends of a link per row
+    """
+    k, n = _resolve(k, n)
+    sub_hosts = count_nodes(level - 1, n)[0]  # number of hosts in a DCell_(level-1)
+    num_hosts = (sub_hosts + 1) * sub_hosts   # number of hosts in a DCell_level
+    i, j = np.triu_indices(sub_hosts + 1, 1)
+    bases = np.arange(0, count_nodes(k, n)[0], num_hosts, dtype=np.int64)[:, np.newaxis] + 1
+    links = np.empty((len(bases) * len(i), 2), dtype=np.int64)
+    links[:, 0] = (bases + i * sub_hosts + j - 1).ravel()
+    links[:, 1] = (bases + j * sub_hosts + i).ravel()
+    return links
+
+
+def radix_table(k=None, n=None):
+    """Get the radix of each entry of k+1 tuple ids, precomputed once for each (k, n).
+
+    The i-th entry of a k+1 tuple id indexes DCell_(k-i-1)s, i.e. its radix is the number of hosts
+    in a DCell_(k-i-1), and 1 for the last entry indexing hosts in a DCell_0.
+
+    Args:
+        k (int): Level of DCell to calculate, DCELL_K if None
+        n (int): Number of hosts in a DCell_0, DCELL_N if None
+
+    Returns:
+        radix (tuple): k+1 radix of the tuple id entries
+    """
+    k, n = _resolve(k, n)
+    radix = _RADIX_TABLES.get((k, n))
+    if radix is None:
+        radix, num_hosts = [1], n
+        for _ in range(k):
+            radix.insert(0, num_hosts)
+            num_hosts *= num_hosts + 1
+        radix = _RADIX_TABLES[(k, n)] = tuple(radix)
+    return radix
+
+
+# map: (k, n) => radix of k+1 tuple id entries
+_RADIX_TABLES = {}
+
+
+def _resolve(k, n):
+    """Resolve DCell level and number of hosts in a DCell_0 defaulting to the configured ones."""
+    return DCELL_K if k is None else k, DCELL_N if n is None else n
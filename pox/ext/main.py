@@ -37,6 +37,9 @@ class DCellController(Controller):
             )
         }
         Controller.__init__(self, **args)
+        # remove the marker of a previous run before the controller starts, see waitController()
+        if os.path.exists(comm.ROUTES_READY_FILE):
+            os.remove(comm.ROUTES_READY_FILE)
 
 
 class TreeController(Controller):
@@ -58,6 +61,64 @@ class TreeController(Controller):
         Controller.__init__(self, **args)
 
 
+# port iperf servers listen on
+IPERF_PORT = 5001
+# maximum time (seconds) to wait for the controller to install routes
+SETUP_TIMEOUT = 60
+# maximum time (seconds) to wait for servers to listen
+LISTEN_TIMEOUT = 10
+# interval (seconds) of polling readiness signals
+POLL_INTERVAL = 0.1
+
+
+def waitController(net, tree):
+    """Wait until all switches are connected to the controller and, for DCell, routes installed.
+
+    The DCell controller creates comm.ROUTES_READY_FILE once all flow entries are acknowledged by
+    the switches, the tree controller learns routes from traffic and only needs the connections.
+    """
+    print "Waiting controller setup..."
+    start = time.time()
+    net.waitConnected(timeout=SETUP_TIMEOUT)
+    if not tree:
+        while not os.path.exists(comm.ROUTES_READY_FILE):
+            if time.time() - start > SETUP_TIMEOUT:
+                print "Warning: routes not installed after {} seconds".format(SETUP_TIMEOUT)
+                break
+            time.sleep(POLL_INTERVAL)
+    print "Controller ready in {:.1f} seconds".format(time.time() - start)
+
+
+def startIperf(host, args, log):
+    """Start iperf in background on a host, return its (host, pid)."""
+    host.cmd("iperf {} >{} 2>&1 &".format(args, log))
+    return host, host.lastPid
+
+
+def waitListening(hosts, port=IPERF_PORT):
+    """Wait until a server listens on a TCP port of each host."""
+    start = time.time()
+    for host in hosts:
+        while host.cmd("ss -ltn | grep -c ':{} '".format(port)).strip() in ("", "0"):
+            if time.time() - start > LISTEN_TIMEOUT:
+                print "Warning: {} not listening on port {}".format(host.name, port)
+                break
+            time.sleep(POLL_INTERVAL)
+
+
+def waitExit(procs, timeout):
+    """Wait until processes started by startIperf() exit, at most timeout seconds."""
+    deadline = time.time() + timeout
+    running = list(procs)
+    while running:
+        running = [(host, pid) for host, pid in running if os.path.exists("/proc/{}".format(pid))]
+        if running and time.time() > deadline:
+            print "Warning: {} processes still running after {} seconds".format(
+                len(running), timeout)
+            break
+        time.sleep(POLL_INTERVAL)
+
+
 def testFaultTolerance():
     """Fault-tolerance test in Section 7.3 of the DCell paper."""
     SERVER_LOG = os.path.join(comm.DIR_LOG, "fault_server.log")
@@ -72,8 +133,7 @@ def testFaultTolerance():
     # create net
     net = Mininet(topo=DCellTopo(tree=False), link=TCLink, controller=DCellController)
     net.start()
-    print "Waiting controller setup..."
-    time.sleep(5)
+    waitController(net, tree=False)
     net.pingAll()
     print "\n[Fault-Tolerance Test]"
 
@@ -85,13 +145,12 @@ def testFaultTolerance():
 
     # start iperf server on host (4,3)
     print "Running iperf server..."
-    net["h20"].cmd("iperf -s >{} 2>&1 &".format(SERVER_LOG))
-    time.sleep(1)
+    startIperf(net["h20"], "-s", SERVER_LOG)
+    waitListening([net["h20"]])
 
     # start iperf client on host (0,0)
     print "Running iperf client (estimated duration: {} seconds)...".format(DURATION)
-    net["h1"].cmd("iperf -c 10.0.0.20 -t {} -i 1 -y c >{} 2>&1 &"
-                  .format(DURATION, CLIENT_LOG))
+    client = startIperf(net["h1"], "-c 10.0.0.20 -t {} -i 1 -y c".format(DURATION), CLIENT_LOG)
 
     # unplug link (0,3)-(4,0) at time 34s
     time.sleep(34)
@@ -108,7 +167,7 @@ def testFaultTolerance():
     net.configLinkStatus("s4", "s17", "down")
     net.configLinkStatus("s4", "s21", "down")
     print "104s: (0,3) down"
-    time.sleep(60)
+    waitExit([client], DURATION - 104 + 10)
 
     # build figure
     throughputs = []
@@ -127,6 +186,85 @@ def testFaultTolerance():
     net.stop()
 
 
+def testRackFailure():
+    """Rack failure test: unplug the link between a host and its mini switch."""
+    SERVER_LOG = os.path.join(comm.DIR_LOG, "rack_server.log")
+    CLIENT_LOG = os.path.join(comm.DIR_LOG, "rack_client.log")
+    FIGURE = os.path.join(comm.DIR_FIGURE, "rack_failure.png")
+    DURATION = 60  # seconds
+    DOWN, UP = 20, 40  # seconds
+    RECOVERED = 0.8  # fraction of the throughput before failure
+
+    if comm.DCELL_K != 1 or comm.DCELL_N != 4:
+        print "Failed: require level-1 DCell with n=4"
+        return
+
+    # create net
+    net = Mininet(topo=DCellTopo(tree=False), link=TCLink, controller=DCellController)
+    net.start()
+    waitController(net, tree=False)
+    net.pingAll()
+    print "\n[Rack Failure Test]"
+
+    # create results directory
+    if not os.path.exists(comm.DIR_LOG):
+        os.mkdir(comm.DIR_LOG)
+    if not os.path.exists(comm.DIR_FIGURE):
+        os.mkdir(comm.DIR_FIGURE)
+
+    # start iperf server on host (0,1)
+    print "Running iperf server..."
+    startIperf(net["h2"], "-s", SERVER_LOG)
+    waitListening([net["h2"]])
+
+    # start iperf client on host (0,0), both hosts in the same DCell_0
+    print "Running iperf client (estimated duration: {} seconds)...".format(DURATION)
+    client = startIperf(net["h1"], "-c 10.0.0.2 -t {} -i 1 -y c".format(DURATION), CLIENT_LOG)
+
+    # unplug link (0,0)-mini switch, traffic detours through DCell_0s 1 and 2
+    time.sleep(DOWN)
+    net.configLinkStatus("s1", "s21", "down")
+    print "{}s: (0,0)-s21 down".format(DOWN)
+
+    # replug link (0,0)-mini switch
+    time.sleep(UP - DOWN)
+    net.configLinkStatus("s1", "s21", "up")
+    print "{}s: (0,0)-s21 up".format(UP)
+    waitExit([client], DURATION - UP + 10)
+
+    # measure time until the throughput recovers after failure
+    throughputs = []
+    with open(CLIENT_LOG, "r") as f:
+        for line in f.readlines():
+            throughputs.append(int(line.strip().split(",")[-1]) / 1e6)  # Mbps
+    before = throughputs[1:DOWN]
+    before = sum(before) / max(len(before), 1)
+    recovery = None
+    for t in range(DOWN, min(UP, len(throughputs))):
+        if throughputs[t] >= RECOVERED * before:
+            recovery = t - DOWN + 1
+            break
+    if recovery is None:
+        print "Throughput not recovered before (0,0)-s21 up"
+    else:
+        print "Throughput recovered in {} seconds ({:.1f} Mbps before failure)".format(
+            recovery, before)
+
+    # build figure
+    plt.plot(range(len(throughputs)), throughputs, "r")
+    plt.axvline(DOWN, color="k", linestyle="--")
+    plt.axvline(UP, color="k", linestyle="--")
+    plt.title("Rack Failure Test")
+    plt.xlabel("Time (second)")
+    plt.ylabel("TCP Throughput (Mb/s)")
+    plt.savefig(FIGURE)
+    plt.clf()
+
+    # stop net
+    print ""
+    net.stop()
+
+
 def testNetworkCapacity():
     """Network capacity test in Section 7.3 of the DCell paper."""
     SERVER_LOG = os.path.join(comm.DIR_LOG, "capacity_server_{}.log")
@@ -147,8 +285,7 @@ def testNetworkCapacity():
             controller=TreeController if tree else DCellController
         )
         net.start()
-        print "Waiting controller setup..."
-        time.sleep(5)
+        waitController(net, tree)
         net.pingAll()
         print "\n[Network Capacity Test - {}]".format("Tree" if tree else "DCell")
 
@@ -160,22 +297,23 @@ def testNetworkCapacity():
 
         # start iperf server on each host
         print "Running iperf server..."
-        for i in range(1, 21):
-            host_name = "h" + str(i)
-            net[host_name].cmd("iperf -s >{} 2>&1 &".format(SERVER_LOG.format(i)))
-        time.sleep(1)
+        servers = [net["h" + str(i)] for i in range(1, 21)]
+        for i, host in enumerate(servers, 1):
+            startIperf(host, "-s", SERVER_LOG.format(i))
+        waitListening(servers)
 
         # start iperf client on each host
         print "Running iperf client (estimated duration: {} seconds)...".format(DURATION)
+        clients = []
         for i in range(1, 21):
             for j in range(1, 21):
                 if i != j:
-                    host_name = "h" + str(i)
-                    net[host_name].cmd("iperf -c 10.0.0.{} -n {} -i 1 -y c >{} 2>&1 &"
-                                       .format(j, DATA_SIZE, CLIENT_LOG.format(i, j)))
+                    clients.append(startIperf(
+                        net["h" + str(i)], "-c 10.0.0.{} -n {} -i 1 -y c".format(j, DATA_SIZE),
+                        CLIENT_LOG.format(i, j)))
 
         # wait client finish
-        time.sleep(DURATION)
+        waitExit(clients, DURATION)
 
         # compute aggregated throughputs every seconds
         throughputs = []
@@ -216,12 +354,12 @@ def main():
     if cli:  # run Mininet CLI
         net = Mininet(topo=DCellTopo(tree=False), link=TCLink, controller=DCellController)
         net.start()
-        print "Waiting controller setup..."
-        time.sleep(3)
+        waitController(net, tree=False)
         CLI(net)
         net.stop()
     else:  # run tests
         testFaultTolerance()
+        testRackFailure()
         testNetworkCapacity()
         print "\nFinished: please see directory \"figures\" for details"
 
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# pylint: disable=missing-docstring,invalid-name
+
+"""Mock OpenFlow connections to run the controller offline, shared by benchmarks and tests."""
+
+import struct
+
+
+class MockConnection(object):
+    """Connection to a switch counting the OpenFlow messages sent to it.
+
+    Subclasses handle each message by overriding handle_msg().
+    """
+
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.num_sends = 0
+        self.num_msgs = 0
+        self.num_bytes = 0
+
+    def addListeners(self, *args, **kw):
+        pass
+
+    def send(self, data):
+        if not isinstance(data, bytes):
+            data = data.pack()
+        self.num_sends += 1
+        self.num_bytes += len(data)
+
+        # split messages packed in the buffer by their header length
+        offset = 0
+        while offset < len(data):
+            msg_type, length = struct.unpack_from("!xBH", data, offset)
+            self.handle_msg(msg_type, data[offset:offset + length])
+            offset += length
+            self.num_msgs += 1
+
+    def handle_msg(self, msg_type, data):
+        """Handle one packed OpenFlow message of a given type sent to the switch."""
+        pass
+
+
+class MockOpenFlow(object):
+    """Replacement of the openflow component holding the mock connections."""
+
+    clear_flows_on_connect = True
+
+    def __init__(self):
+        self.connections = {}
+
+    def addListeners(self, *args, **kw):
+        pass
+
+    def counters(self):
+        """Return total (num_sends, num_msgs, num_bytes) of all connections."""
+        conns = self.connections.values()
+        return (sum(conn.num_sends for conn in conns), sum(conn.num_msgs for conn in conns),
+                sum(conn.num_bytes for conn in conns))
@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+# pylint: disable=missing-docstring,invalid-name
+
+import logging
+
+import comm
+from wiring import DCellWiring
+
+# also imported outside POX (analysis, Mininet topology), where the logs are dropped unless
+# the caller configures logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class DCellRouting(object):
+    """DCellRouting with local-reroute from the DCell paper.
+
+    A routing path is represented as a tuple of hops. Each hop is a (dpid, out_port) tuple of a
+    switch on the path. Port numbers and the switches they connect are looked up in the
+    DCellWiring shared with the Mininet topology.
+
+    Paths are memoized for each pair of (k+1)-tuple ids, including the sub-paths built during the
+    recursion. Each cached path records the links it depends on, i.e. the links it passes and the
+    broken links it detours around, so that a link state change only drops the affected paths.
+    """
+
+    def __init__(self, bad_links, link_loads=None, wiring=None):
+        """Create a DCellRouting instance.
+
+        Args:
+            bad_links (set): broken links as (dpid1, dpid2) tuples where dpid1 < dpid2, shared
+                with the caller, who should call invalidate() after changing a link state
+            link_loads (dict): utilization of links: (dpid1, dpid2) => float, shared with the
+                caller who updates it, None to select the first proxy node found instead of the
+                least loaded one
+            wiring (DCellWiring): wiring of the DCell, loaded from comm.TOPO_FILE (or computed if
+                not available) if None
+        """
+        self._wiring = DCellWiring.load_or_build() if wiring is None else wiring
+        self._num_hosts = self._wiring.num_hosts
+        self._bad_links = bad_links
+        self._link_loads = link_loads
+
+        # map: (tpl_src, tpl_dst, avoid) => (hops, links)
+        # avoid is a frozenset of links considered broken in addition to bad_links
+        # hops is None if no path can be found, links is a frozenset of links the path depends on
+        self._cache = {}
+
+        # map: link => set of (tpl_src, tpl_dst, avoid) whose cached path depends on the link
+        self._link_keys = {}
+
+    def route(self, tpl_src, tpl_dst):
+        """Get the routing path from source host to destination host.
+
+        Args:
+            tpl_src (list): k+1 tuple id of the source host
+            tpl_dst (list): k+1 tuple id of the destination host
+
+        Returns:
+            hops (tuple): (dpid, out_port) of each switch on the path, None if no path found
+        """
+        hops, _ = self._dcell_route(tuple(tpl_src), tuple(tpl_dst), frozenset())
+        if hops is None:
+            return None
+        # route from destination switch to host
+        return self._join(hops, ((comm.host_id(tpl_dst), DCellWiring.HOST_PORT),))
+
+    def backup_route(self, tpl_src, tpl_dst, link):
+        """Get the routing path from source host to destination host as if a link were broken.
+
+        Args:
+            tpl_src (list): k+1 tuple id of the source host
+            tpl_dst (list): k+1 tuple id of the destination host
+            link (tuple): (dpid1, dpid2) link to avoid
+
+        Returns:
+            hops (tuple): (dpid, out_port) of each switch on the path, None if no path found
+        """
+        hops, _ = self._dcell_route(tuple(tpl_src), tuple(tpl_dst), frozenset((link,)))
+        if hops is None:
+            return None
+        return self._join(hops, ((comm.host_id(tpl_dst), DCellWiring.HOST_PORT),))
+
+    def multipath_route(self, tpl_src, tpl_dst, num_paths):
+        """Get multiple routing paths from source host to destination host.
+
+        The first path is the DCellRouting path. The others detour through proxy nodes in the
+        neighbor sub DCells of the level where the two hosts diverge, as if the middle link between
+        their sub DCells were broken, so that the paths share few links with each other.
+
+        Args:
+            tpl_src (list): k+1 tuple id of the source host
+            tpl_dst (list): k+1 tuple id of the destination host
+            num_paths (int): maximum number of paths
+
+        Returns:
+            paths (list): paths as returned by route(), empty if no path found
+        """
+        tpl_src, tpl_dst = tuple(tpl_src), tuple(tpl_dst)
+        paths = []
+        hops = self.route(tpl_src, tpl_dst)
+        if hops is not None:
+            paths.append(hops)
+
+        pref = self._common_prefix(tpl_src, tpl_dst)
+        if len(pref) == comm.DCELL_K:
+            return paths  # single path within a DCell_0
+
+        mid_src, mid_dst = self._middle_link(pref, tpl_src[len(pref)], tpl_dst[len(pref)])
+        avoid = frozenset((self._link(comm.host_id(mid_src), comm.host_id(mid_dst)),))
+        for proxy, _ in self._iter_proxies(tpl_src, tpl_dst, pref, avoid, set()):
+            if len(paths) >= num_paths:
+                break
+            hops1, _ = self._dcell_route(tpl_src, proxy, avoid)
+            hops2, _ = self._dcell_route(proxy, tpl_dst, avoid)
+            if hops1 is None or hops2 is None:
+                continue
+            hops = hops1 + hops2 + ((comm.host_id(tpl_dst), DCellWiring.HOST_PORT),)
+            if len(set(dpid for dpid, _ in hops)) < len(hops):
+                continue  # path passing a switch twice
+            if hops not in paths:
+                paths.append(hops)
+
+        return paths
+
+    def route_links(self, tpl_src, tpl_dst):
+        """Get the links the routing path from source host to destination host depends on.
+
+        Returns:
+            links (frozenset): (dpid1, dpid2) links passed by the path or broken links it detours
+                around, the path may change only if one of these links changes its state
+        """
+        _, links = self._dcell_route(tuple(tpl_src), tuple(tpl_dst), frozenset())
+        return links
+
+    def backup_route_links(self, tpl_src, tpl_dst, link):
+        """Get the links the routing path avoiding a link depends on, see route_links()."""
+        _, links = self._dcell_route(tuple(tpl_src), tuple(tpl_dst), frozenset((link,)))
+        return links
+
+    def port_link(self, dpid, port):
+        """Get the link connected to a switch port, None if the port is connected to a host."""
+        peer, _ = self._wiring.peer(dpid, port)
+        return None if peer == 0 else self._link(dpid, peer)
+
+    def in_port(self, dpid, out_port):
+        """Get the input port on the next switch of a frame sent from a switch through a port."""
+        return self._wiring.peer(dpid, out_port)[1]
+
+    def invalidate(self, link):
+        """Drop cached paths depending on a link whose state has changed."""
+        for key in self._link_keys.pop(link, ()):
+            _, links = self._cache.pop(key)
+            for other in links:
+                if other != link:
+                    self._link_keys[other].discard(key)
+
+    def clear(self):
+        """Drop all cached paths."""
+        self._cache = {}
+        self._link_keys = {}
+
+    def _dcell_route(self, tpl_src, tpl_dst, avoid):
+        """Memoized DCellRouting(src, dst), return (hops, links)."""
+        key = (tpl_src, tpl_dst, avoid)
+        entry = self._cache.get(key)
+        if entry is None:
+            entry = self._build_dcell_route(tpl_src, tpl_dst, avoid)
+            self._cache[key] = entry
+            for link in entry[1]:
+                if link not in self._link_keys:
+                    self._link_keys[link] = set()
+                self._link_keys[link].add(key)
+        return entry
+
+    def _build_dcell_route(self, tpl_src, tpl_dst, avoid):
+        """DCellRouting(src, dst) from the paper, return (hops, links)."""
+
+        log.debug("build_dcell_route | tpl_src=%s | tpl_dst=%s", tpl_src, tpl_dst)
+
+        if tpl_src == tpl_dst:
+            return (), frozenset()  # skip routing to self
+
+        pref = self._common_prefix(tpl_src, tpl_dst)
+        pref_len = len(pref)
+
+        if pref_len == comm.DCELL_K:  # same DCell_0
+
+            # check mini switch connection
+            host_src, host_dst = comm.host_id(tpl_src), comm.host_id(tpl_dst)
+            mini_dpid = self._mini_dpid(host_src)
+            mini_in, mini_out = self._link(host_src, mini_dpid), self._link(host_dst, mini_dpid)
+            links = frozenset((mini_in, mini_out))
+            if self._is_bad_link(mini_in, avoid) or self._is_bad_link(mini_out, avoid):
+                return self._rack_route(tpl_src, tpl_dst, avoid, links)
+
+            return ((host_src, DCellWiring.MINI_PORT),
+                    (mini_dpid, self._wiring.mini_port(host_dst))), links
+
+        # get the link connecting two sub DCells
+        mid_src, mid_dst = self._middle_link(pref, tpl_src[pref_len], tpl_dst[pref_len])
+        host_mid_src = comm.host_id(mid_src)
+        mid_link = self._link(host_mid_src, comm.host_id(mid_dst))
+
+        # route to proxy if middle link is broken
+        if self._is_bad_link(mid_link, avoid):
+            proxy, links = self._select_proxy(tpl_src, tpl_dst, pref, avoid)
+            links = links | frozenset((mid_link,))
+            if proxy is None:
+                log.warn("build_dcell_route | no proxy node | src={} | dst={}"
+                         .format(tpl_src, tpl_dst))
+                return None, links
+            hops1, links1 = self._dcell_route(tpl_src, proxy, avoid)
+            hops2, links2 = self._dcell_route(proxy, tpl_dst, avoid)
+            links = links | links1 | links2
+            if hops1 is None or hops2 is None:
+                return None, links
+            return self._join(hops1, hops2), links
+
+        # build routes recursively
+        hops1, links1 = self._dcell_route(tpl_src, mid_src, avoid)
+        hops2, links2 = self._dcell_route(mid_dst, tpl_dst, avoid)
+        links = links1 | links2 | frozenset((mid_link,))
+        if hops1 is None or hops2 is None:
+            return None, links
+
+        # the middle link switches forward through the level-(k-pref_len) port
+        level_port = self._wiring.level_port(host_mid_src, comm.DCELL_K - pref_len)
+        return self._join(hops1, ((host_mid_src, level_port),), hops2), links
+
+    def _rack_route(self, tpl_src, tpl_dst, avoid, links):
+        """Local-reroute within a DCell_0 whose mini switch link is broken, return (hops, links).
+
+        A host switch cut off from its mini switch is reached through its level-1 link instead,
+        i.e. the path leaves the DCell_0 to the neighbor host of the source (or comes from the
+        neighbor host of the destination) in another DCell_0. The level-1 link is avoided by the
+        path in between, so that it enters the DCell_0 again through a proxy DCell_0.
+
+        Args:
+            links (frozenset): mini switch links checked before the reroute
+        """
+        if comm.DCELL_K == 0:
+            log.error("build_dcell_route | cannot handle rack failure | mini_switch={}"
+                      .format(self._mini_dpid(comm.host_id(tpl_src))))
+            return None, links
+
+        host_src, host_dst = comm.host_id(tpl_src), comm.host_id(tpl_dst)
+        mini_dpid = self._mini_dpid(host_src)
+        first, last = (), ()
+
+        if self._is_bad_link(self._link(host_src, mini_dpid), avoid):
+            # leave the DCell_0 through the level-1 link of the source switch
+            port = self._wiring.level_port(host_src, 1)
+            link = self.port_link(host_src, port)
+            links = links | frozenset((link,))
+            if self._is_bad_link(link, avoid):
+                return None, links
+            first = ((host_src, port),)
+            avoid = avoid | frozenset((link,))
+            tpl_src = tuple(comm.tuple_id(link[0] if link[1] == host_src else link[1]))
+
+        if self._is_bad_link(self._link(host_dst, mini_dpid), avoid):
+            # enter the DCell_0 through the level-1 link of the destination switch
+            peer, port = self._wiring.peer(host_dst, self._wiring.level_port(host_dst, 1))
+            link = self._link(host_dst, peer)
+            links = links | frozenset((link,))
+            if self._is_bad_link(link, avoid):
+                return None, links
+            last = ((peer, port),)
+            avoid = avoid | frozenset((link,))
+            tpl_dst = tuple(comm.tuple_id(peer))
+
+        log.debug("build_dcell_route | rack failure reroute | mini_switch=%d | src=%s | dst=%s",
+                  mini_dpid, tpl_src, tpl_dst)
+        hops, sub_links = self._dcell_route(tpl_src, tpl_dst, avoid)
+        links = links | sub_links
+        if hops is None:
+            return None, links
+        return self._join(first, hops, last), links
+
+    def _select_proxy(self, tpl_src, tpl_dst, pref, avoid):
+        """Select a proxy node if the middle link between two nodes fail.
+
+        A neighbor DCell is selected only if both its middle links, from the source DCell and to
+        the destination DCell, are working. Otherwise routing from the proxy node could select
+        another proxy node leading back to the source DCell.
+
+        If link loads are given, the neighbor DCell whose two middle links have the lowest total
+        utilization is selected. The selected middle links are then considered more loaded by
+        comm.PROXY_LOAD_ESTIMATE until the caller updates the link loads, so that paths rerouted
+        at once spread over the neighbor DCells. Cached paths keep their proxy nodes until
+        invalidated by a link state change.
+
+        Returns:
+            proxy (tuple): k+1 tuple id of the proxy node, None if no proxy node
+            links (frozenset): broken middle links checked before selecting the proxy node
+        """
+        links = set()
+        if self._link_loads is None:
+            for proxy, _ in self._iter_proxies(tpl_src, tpl_dst, pref, avoid, links):
+                return proxy, frozenset(links)  # selected proxy node
+            return None, frozenset(links)  # no proxy node
+
+        # select the least loaded proxy node
+        best, best_links, best_load = None, (), None
+        for proxy, mid_links in self._iter_proxies(tpl_src, tpl_dst, pref, avoid, links):
+            load = sum(self._link_loads.get(link, 0.0) for link in mid_links)
+            if best_load is None or load < best_load:
+                best, best_links, best_load = proxy, mid_links, load
+        for link in best_links:
+            self._link_loads[link] = self._link_loads.get(link, 0.0) + comm.PROXY_LOAD_ESTIMATE
+        return best, frozenset(links)
+
+    def _iter_proxies(self, tpl_src, tpl_dst, pref, avoid, links):
+        """Iterate over proxy nodes in the neighbor DCells, see _select_proxy().
+
+        Broken middle links checked before each proxy node are added to the given links set.
+
+        Yields:
+            proxy (tuple): k+1 tuple id of the proxy node
+            mid_links (tuple): middle links from the source DCell and to the destination DCell
+        """
+        pref_len = len(pref)
+        num_dcells = comm.count_dcells(comm.DCELL_K - pref_len)  # number of DCell_(k-1)
+
+        # check neighbor DCells one by one
+        for i in range(1, num_dcells):
+
+            idx = (tpl_src[pref_len] + i) % num_dcells
+            if idx == tpl_dst[pref_len]:
+                continue  # cannot directly route to destination due to broken link
+
+            mid_src, mid_dst = self._middle_link(pref, tpl_src[pref_len], idx)
+            mid_link = self._link(comm.host_id(mid_src), comm.host_id(mid_dst))
+            if self._is_bad_link(mid_link, avoid):
+                links.add(mid_link)
+                continue  # broken middle link
+
+            next_src, next_dst = self._middle_link(pref, idx, tpl_dst[pref_len])
+            next_link = self._link(comm.host_id(next_src), comm.host_id(next_dst))
+            if self._is_bad_link(next_link, avoid):
+                links.add(next_link)
+                continue  # broken middle link from the proxy DCell
+
+            yield mid_dst, (mid_link, next_link)
+
+    def _join(self, *parts):
+        """Concatenate hops of sub paths, erasing loops through a switch passed twice.
+
+        A detour (e.g. local-reroute out of and back into a DCell_0) may pass a switch that is
+        passed again later. Keeping only the last hop of the switch drops the loop in between, as
+        a switch can forward the frames of a host pair through one port only.
+        """
+        hops = []
+        index = {}  # map: dpid => index in hops
+        for part in parts:
+            for dpid, out_port in part:
+                if dpid in index:
+                    for loop_dpid, _ in hops[index[dpid]:]:
+                        del index[loop_dpid]
+                    del hops[len(index):]
+                index[dpid] = len(hops)
+                hops.append((dpid, out_port))
+        return tuple(hops)
+
+    def _middle_link(self, pref, src_idx, dst_idx):
+        """Get the middle links that connects two sub DCells."""
+        pref_len = len(pref)
+
+        swap = False
+        if src_idx > dst_idx:
+            src_idx, dst_idx = dst_idx, src_idx
+            swap = True
+
+        src_mid_suffix = comm.tuple_id(dst_idx, comm.DCELL_K - pref_len - 1)
+        dst_mid_suffix = comm.tuple_id(src_idx + 1, comm.DCELL_K - pref_len - 1)
+        src_mid = pref + (src_idx,) + tuple(src_mid_suffix)
+        dst_mid = pref + (dst_idx,) + tuple(dst_mid_suffix)
+
+        if swap:
+            src_mid, dst_mid = dst_mid, src_mid
+
+        return src_mid, dst_mid
+
+    def _common_prefix(self, tpl1, tpl2):
+        """Return the common prefix entries (as a new tuple) of two given tuples."""
+        for i in range(min(len(tpl1), len(tpl2))):
+            if tpl1[i] != tpl2[i]:
+                return tpl1[:i]
+        return tpl1[:min(len(tpl1), len(tpl2))]
+
+    def _is_bad_link(self, link, avoid):
+        """Check whether a link is broken or to be avoided."""
+        return link in self._bad_links or link in avoid
+
+    def _link(self, dpid1, dpid2):
+        """Return the link between two switches with normalized dpid order."""
+        return (dpid1, dpid2) if dpid1 < dpid2 else (dpid2, dpid1)
+
+    def _mini_dpid(self, host_id):
+        """Return the dpid of the mini switch in the DCell_0 where a given host is located."""
+        return int(self._wiring.peers[host_id, DCellWiring.MINI_PORT])
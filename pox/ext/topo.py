@@ -4,16 +4,19 @@
 from mininet.topo import Topo
 
 import comm
+from wiring import DCellWiring
 
 
 class DCellTopo(Topo):
 
-    def build(self, tree):
+    def build(self, tree, verbose=False):
         """Build a DCell network topology, called by Topo.__init__().
 
         Args:
             tree (bool): true if use tree topology, false otherwise
+            verbose (bool): true if print each link added, false otherwise
         """
+        self._verbose = verbose
         if tree:
             self._build_tree()
         else:
@@ -37,61 +40,31 @@ class DCellTopo(Topo):
             self._add_link(host, switches[i / 4])
 
     def _build_dcell(self):
-        print "build_dcell | dcell_k={} | dcell_n={}".format(comm.DCELL_K, comm.DCELL_N)
-
-        self._hosts = {}     # (k+1)-tuple -> host name
-        self._switches = {}  # (k+1)-tuple -> switch name
-        self._nhost = 1
-        self._nswitch = 1
-        self._nswitch0, nswitch = comm.count_nodes()
-
-        def build_helper(self, pref, n, level):
-            if level == 0: # build DCell_0
-                self._nswitch0 += 1
-                switch_name0 = "s" + str(self._nswitch0)
-                s0 = self._add_switch(switch_name0)
-                for i in range(n):
-                    id = str(pref + [i])
-                    # add a host
-                    host_name = "h" + str(self._nhost)
-                    self._nhost += 1
-                    host = self._add_host(host_name)
-                    self._hosts[id] = host
+        """Build a DCell network topology from its DCellWiring.
 
-                    # add a switch combined with the host
-                    switch_name = "s" + str(self._nswitch)
-                    self._nswitch += 1
-                    switch = self._add_switch(switch_name)
-                    self._switches[id] = switch
-
-                    self._add_link(switch, host)
-                    self._add_link(s0, switch)
-                    print(id + " | (" + host_name + "..." + switch_name + ") "
-                          + "(" + switch_name0 + "..." + switch_name + ")")
-                return
+        Host i and its host switch are named "hi" and "si", the mini switch of the j-th DCell_0 is
+        named "s(num_hosts+j)", i.e. the switch names carry the dpids of the wiring. Links are
+        added with the ports of the wiring, which is then saved to comm.TOPO_FILE for the
+        controller.
+        """
+        print "build_dcell | dcell_k={} | dcell_n={}".format(comm.DCELL_K, comm.DCELL_N)
 
-            for i in range(g[level]):  # build DCell_(l-1)s
-                build_helper(self, pref + [i], n, level - 1)
+        wiring = DCellWiring.build()
+        switches = [None]  # dpid -> switch name
+        for dpid in xrange(1, wiring.num_switches + 1):
+            switches.append(self._add_switch("s" + str(dpid)))
+        for host_id in xrange(1, wiring.num_hosts + 1):
+            host = self._add_host("h" + str(host_id))
+            self._add_link(switches[host_id], host, port1=DCellWiring.HOST_PORT)
 
-            for i in range(t[level - 1]):  # connect the DCell_(l-1)s
-                for j in range(i + 1, g[level]):
-                    n1 = str(pref + [i] + comm.tuple_id(j, level - 1, n))
-                    n2 = str(pref + [j] + comm.tuple_id(i + 1, level - 1, n))
-                    s1 = self._switches[n1]
-                    s2 = self._switches[n2]
-                    self._add_link(s1, s2)
-                    print "(" + n1 + "," + s1 + ")...(" + n2 + "," + s2 + ")"
+        for dpid1, port1, dpid2, port2 in wiring.links.tolist():
+            self._add_link(switches[dpid1], switches[dpid2], port1=port1, port2=port2)
+            if self._verbose:
+                print "{} | ({}:{})...({}:{})".format(
+                    list(wiring.tuple_id(dpid1)), switches[dpid1], port1, switches[dpid2], port2)
 
-        t = []  # the number of servers in DCell_l
-        g = []  # the number of DCell_(l-1)s in DCell_l
-        t.append(comm.DCELL_N)
-        g.append(1)
-        for i in range(comm.DCELL_K):
-            g.append(t[i] + 1)
-            t.append(g[i + 1] * t[i])
-        self._nswitch0 = t[comm.DCELL_K]
-        pref = []
-        build_helper(self, pref, comm.DCELL_N, comm.DCELL_K)  # construct DCell
+        if comm.TOPO_FILE is not None:
+            wiring.save(comm.TOPO_FILE)
 
     def _add_host(self, name):
         host_id = int(name[1:])
@@ -101,5 +74,5 @@ class DCellTopo(Topo):
     def _add_switch(self, name):
         return self.addSwitch(name, cls=comm.SWITCH_CLS)
 
-    def _add_link(self, node1, node2):
-        return self.addLink(node1, node2, bw=comm.LINK_BW)
+    def _add_link(self, node1, node2, **params):
+        return self.addLink(node1, node2, bw=comm.LINK_BW, **params)
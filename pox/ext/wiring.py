@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# pylint: disable=missing-docstring,invalid-name
+
+import logging
+import os
+import struct
+
+import numpy as np
+
+import comm
+
+# also imported outside POX (analysis, Mininet topology), where the logs are dropped unless
+# the caller configures logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+
+class DCellWiring(object):
+    """Wiring of a DCell network: the peer of each switch port and the tuple id of each host.
+
+    DCellTopo builds the Mininet network from the links of a DCellWiring and saves it to
+    comm.TOPO_FILE, which the controller memory-maps at launch instead of deriving the port
+    numbering again, so that both sides agree on the wiring by construction.
+
+    Host i is attached to host switch i, the mini switch of the j-th DCell_0 has dpid num_hosts+j.
+    Host switches use port 1 for the host, port 2 for the mini switch and port l+2 for the level-l
+    link. Mini switches use port i+1 for the i-th host in the DCell_0.
+
+    The tables are indexed by dpid (or host id) and port, entry 0 is unused:
+        peers: dpid of the switch connected to each port, 0 for a host or an unused port
+        peer_ports: port on the switch connected to each port, 0 for a host or an unused port
+        tuple_ids: k+1 tuple id of each host
+        links: (dpid1, port1, dpid2, port2) of each link between two switches
+
+    The ports of the level links of each host switch are derived from these tables on first use:
+        level_ports: port of the level-l link of each host switch, port of the mini switch link
+            for level 0
+    """
+
+    HOST_PORT = 1  # host switch port connected to the host
+    MINI_PORT = 2  # host switch port connected to the mini switch
+
+    # file header: magic, k, n, num_hosts, num_switches, num_ports, num_links
+    _HEADER = struct.Struct("!4s6I")
+    _MAGIC = "DCWR"
+
+    def __init__(self, k, n, peers, peer_ports, tuple_ids, links):
+        self.k, self.n = k, n
+        self.num_hosts, self.num_switches = len(tuple_ids) - 1, len(peers) - 1
+        self.peers = peers
+        self.peer_ports = peer_ports
+        self.tuple_ids = tuple_ids
+        self.links = links
+        self._level_ports = None
+
+    @classmethod
+    def build(cls, k=None, n=None):
+        """Compute the wiring of a given DCell, DCELL_K and DCELL_N if None."""
+        k = comm.DCELL_K if k is None else k
+        n = comm.DCELL_N if n is None else n
+        num_hosts, num_switches = comm.count_nodes(k, n)
+        host_ids = np.arange(1, num_hosts + 1, dtype=np.int64)
+        mini_ids = num_hosts + 1 + (host_ids - 1) // n
+
+        # links in the order their ports are numbered: mini switch links then level 1 to k links
+        parts = [np.column_stack((host_ids, np.full(num_hosts, cls.MINI_PORT, dtype=np.int64),
+                                  mini_ids, (host_ids - 1) % n + 1))]
+        for level in range(1, k + 1):
+            ends = comm.level_links(level, k, n)
+            port = np.full(len(ends), cls.MINI_PORT + level, dtype=np.int64)
+            parts.append(np.column_stack((ends[:, 0], port, ends[:, 1], port)))
+        links = np.concatenate(parts).astype(np.int32)
+
+        num_ports = max(k + 2, n)
+        peers = np.zeros((num_switches + 1, num_ports + 1), dtype=np.int32)
+        peer_ports = np.zeros_like(peers)
+        peers[links[:, 0], links[:, 1]] = links[:, 2]
+        peer_ports[links[:, 0], links[:, 1]] = links[:, 3]
+        peers[links[:, 2], links[:, 3]] = links[:, 0]
+        peer_ports[links[:, 2], links[:, 3]] = links[:, 1]
+
+        tuple_ids = np.zeros((num_hosts + 1, k + 1), dtype=np.int32)
+        tuple_ids[1:] = comm.tuple_ids(host_ids, k, n)
+        return cls(k, n, peers, peer_ports, tuple_ids, links)
+
+    @classmethod
+    def load(cls, path, k=None, n=None):
+        """Memory-map the wiring saved to a file.
+
+        Returns:
+            wiring (DCellWiring): the wiring, None if the file is missing, malformed or wires
+                another DCell than the given one (DCELL_K and DCELL_N if None)
+        """
+        k = comm.DCELL_K if k is None else k
+        n = comm.DCELL_N if n is None else n
+        try:
+            with open(path, "rb") as f:
+                header = cls._HEADER.unpack(f.read(cls._HEADER.size))
+        except (IOError, struct.error) as err:
+            log.debug("load_wiring | file=%s | error=%s", path, err)
+            return None
+        magic, file_k, file_n, num_hosts, num_switches, num_ports, num_links = header
+        if magic != cls._MAGIC or (file_k, file_n) != (k, n):
+            log.warn("load_wiring | file=%s | dcell mismatch", path)
+            return None
+
+        shapes = ((num_switches + 1, num_ports + 1), (num_switches + 1, num_ports + 1),
+                  (num_hosts + 1, k + 1), (num_links, 4))
+        if os.path.getsize(path) != cls._HEADER.size + 4 * sum(r * c for r, c in shapes):
+            log.warn("load_wiring | file=%s | size mismatch", path)
+            return None
+        tables, offset = [], cls._HEADER.size
+        for shape in shapes:
+            tables.append(np.memmap(path, dtype=">i4", mode="r", offset=offset, shape=shape))
+            offset += 4 * shape[0] * shape[1]
+        return cls(k, n, *tables)
+
+    @classmethod
+    def load_or_build(cls, path=None):
+        """Load the wiring of the configured DCell from a file, or compute it if not available."""
+        path = comm.TOPO_FILE if path is None else path
+        wiring = cls.load(path) if path is not None else None
+        return wiring if wiring is not None else cls.build()
+
+    @property
+    def level_ports(self):
+        """Get the level_ports table, see DCellWiring."""
+        if self._level_ports is None:
+            hosts = np.arange(1, self.num_hosts + 1)
+            level_ports = np.zeros((self.num_hosts + 1, self.k + 1), dtype=np.int32)
+            for port in range(1, self.peers.shape[1]):
+                peers = np.asarray(self.peers[1:self.num_hosts + 1, port])
+                used = peers > 0
+
+                # a level-l link connects two hosts in the same DCell_l whose tuple ids first
+                # differ at index k-l, a link to a mini switch is at level 0
+                levels = np.zeros(len(peers), dtype=np.int64)
+                to_host = used & (peers <= self.num_hosts)
+                differ = (np.asarray(self.tuple_ids[hosts[to_host]]) !=
+                          np.asarray(self.tuple_ids[peers[to_host]]))
+                levels[to_host] = self.k - differ.argmax(axis=1)
+                level_ports[hosts[used], levels[used]] = port
+            self._level_ports = level_ports
+        return self._level_ports
+
+    def save(self, path):
+        """Save the wiring to a file as a header followed by big-endian int32 tables."""
+        with open(path, "wb") as f:
+            f.write(self._HEADER.pack(self._MAGIC, self.k, self.n, self.num_hosts,
+                                      self.num_switches, self.peers.shape[1] - 1, len(self.links)))
+            for table in (self.peers, self.peer_ports, self.tuple_ids, self.links):
+                f.write(np.ascontiguousarray(table, dtype=">i4").tobytes())
+
+    def peer(self, dpid, port):
+        """Get (peer_dpid, peer_port) connected to a switch port, (0, 0) if not a switch."""
+        if not 0 < port < self.peers.shape[1]:
+            return 0, 0
+        return int(self.peers[dpid, port]), int(self.peer_ports[dpid, port])
+
+    def mini_port(self, host_id):
+        """Get the mini switch port connected to a host switch."""
+        return int(self.peer_ports[host_id, self.MINI_PORT])
+
+    def level_port(self, host_id, level):
+        """Get the host switch port of the level-l link of a host, 0 if not connected."""
+        return int(self.level_ports[host_id, level])
+
+    def tuple_id(self, host_id):
+        """Get the k+1 tuple id of a host as a tuple."""
+        return tuple(int(entry) for entry in self.tuple_ids[host_id])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# pylint: disable=missing-docstring,invalid-name
+
+"""Tests of the vectorized tuple id conversions against their scalar versions."""
+
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(TEST_DIR, "..", "..", "..", "ext"))
+
+import numpy as np
+
+import comm
+
+# DCell sizes (k, n) to test
+SIZES = [(0, 4), (1, 2), (1, 4), (2, 2), (2, 3), (3, 2)]
+
+
+class CommTest(unittest.TestCase):
+
+    def setUp(self):
+        self._config = (comm.DCELL_K, comm.DCELL_N)
+
+    def tearDown(self):
+        comm.DCELL_K, comm.DCELL_N = self._config
+
+    def test_tuple_ids(self):
+        for k, n in SIZES:
+            num_hosts = comm.count_nodes(k, n)[0]
+            ids = range(1, num_hosts + 1)
+            tuple_ids = comm.tuple_ids(ids, k, n)
+            self.assertEqual(tuple_ids.shape, (num_hosts, k + 1))
+            self.assertEqual(tuple_ids.tolist(), [comm.tuple_id(i, k, n) for i in ids],
+                             "DCell ({}, {})".format(k, n))
+
+            # all tuple ids are distinct and each entry is within its radix
+            self.assertEqual(len(set(map(tuple, tuple_ids.tolist()))), num_hosts)
+            self.assertTrue((tuple_ids >= 0).all())
+            self.assertTrue((tuple_ids[:, -1] < n).all())
+
+    def test_host_ids(self):
+        for k, n in SIZES:
+            num_hosts = comm.count_nodes(k, n)[0]
+            tuple_ids = [comm.tuple_id(i, k, n) for i in range(1, num_hosts + 1)]
+            host_ids = comm.host_ids(tuple_ids, k, n)
+            self.assertEqual(host_ids.tolist(), [comm.host_id(tpl, k, n) for tpl in tuple_ids])
+            self.assertEqual(host_ids.tolist(), range(1, num_hosts + 1))
+
+    def test_round_trip(self):
+        rng = np.random.RandomState(0)
+        for k, n in SIZES:
+            num_hosts = comm.count_nodes(k, n)[0]
+            ids = rng.randint(1, num_hosts + 1, size=50)  # unordered, with repeats
+            tuple_ids = comm.tuple_ids(ids, k, n)
+            self.assertTrue(np.array_equal(comm.host_ids(tuple_ids, k, n), ids))
+            self.assertTrue(np.array_equal(comm.host_ids(tuple_ids[::-2], k, n), ids[::-2]))
+
+    def test_defaults(self):
+        comm.DCELL_K, comm.DCELL_N = 2, 3
+        ids = [1, 7, 156]
+        self.assertEqual(comm.tuple_ids(ids).tolist(), comm.tuple_ids(ids, 2, 3).tolist())
+        self.assertEqual(comm.tuple_ids(ids).tolist(), [comm.tuple_id(i) for i in ids])
+        self.assertEqual(comm.host_ids(comm.tuple_ids(ids)).tolist(), ids)
+
+    def test_empty(self):
+        self.assertEqual(comm.tuple_ids([], 2, 3).shape, (0, 3))
+        self.assertEqual(comm.host_ids(np.zeros((0, 3), dtype=np.int32), 2, 3).shape, (0,))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,678 @@
+#!/usr/bin/env python
+# pylint: disable=missing-docstring,invalid-name
+
+"""Data plane tests of the DCell controller.
+
+The controller runs against mock connections that apply the flow messages sent to them to
+in-memory flow tables, so that frames can be forwarded hop by hop through the DCell to check
+where they end up, without Mininet or Open vSwitch.
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(TEST_DIR, "..", "..", ".."))
+sys.path.append(os.path.join(TEST_DIR, "..", "..", "..", "ext"))
+
+import pox.core
+pox.core.initialize()
+from pox.core import core
+from pox.lib.addresses import EthAddr, IPAddr
+import pox.lib.packet as pkt
+from pox.openflow import (ConnectionDown, ConnectionUp, FlowStatsReceived, PacketIn,
+                          PortStatus)
+from pox.openflow.discovery import Link, LinkEvent
+import pox.openflow.libopenflow_01 as of
+import pox.openflow.nicira as nx
+
+import comm
+import dcell_controller
+from mock_openflow import MockConnection, MockOpenFlow
+from wiring import DCellWiring
+
+# comm configurations overridden by the tests, restored after each test
+CONFIG_NAMES = ("DCELL_K", "DCELL_N", "AGGREGATE_FLOWS", "BACKUP_FLOWS", "REACTIVE_ROUTING",
+                "LINK_EVENT_WINDOW", "AUDIT_INTERVAL", "TOPO_FILE", "ROUTES_READY_FILE",
+                "SNAPSHOT_FILE", "SNAPSHOT_INTERVAL", "ROUTE_WORKERS", "LINK_FLAP_HALF_LIFE",
+                "LINK_FLAP_SUPPRESS", "LINK_FLAP_REUSE", "MULTIPATH_ROUTING",
+                "MULTIPATH_NUM_PATHS", "ARP_FLOWS")
+
+# results of forwarding a frame
+DELIVERED, DROPPED, LOOPED = "delivered", "dropped", "looped"
+
+
+def eth_frame(mac_src, mac_dst):
+    """Create a raw IPv4 frame between two hosts."""
+    packet_ip = pkt.ipv4(srcip=IPAddr(comm.IP_BASE + mac_src),
+                         dstip=IPAddr(comm.IP_BASE + mac_dst), protocol=pkt.ipv4.ICMP_PROTOCOL)
+    packet_eth = pkt.ethernet(src=EthAddr(comm.mac_to_str(mac_src)),
+                              dst=EthAddr(comm.mac_to_str(mac_dst)), type=pkt.ethernet.IP_TYPE)
+    packet_eth.payload = packet_ip
+    return packet_eth.pack()
+
+
+def tcp_frame(mac_src, mac_dst, port_src, port_dst):
+    """Create a raw TCP frame between two hosts."""
+    packet_tcp = pkt.tcp(srcport=port_src, dstport=port_dst, off=5)
+    packet_ip = pkt.ipv4(srcip=IPAddr(comm.IP_BASE + mac_src),
+                         dstip=IPAddr(comm.IP_BASE + mac_dst), protocol=pkt.ipv4.TCP_PROTOCOL)
+    packet_ip.payload = packet_tcp
+    packet_eth = pkt.ethernet(src=EthAddr(comm.mac_to_str(mac_src)),
+                              dst=EthAddr(comm.mac_to_str(mac_dst)), type=pkt.ethernet.IP_TYPE)
+    packet_eth.payload = packet_ip
+    return packet_eth.pack()
+
+
+def eth_mac(ethaddr):
+    """Convert a EthAddr object to a mac address integer, None if wildcarded."""
+    return None if ethaddr is None else int(ethaddr.toStr(separator=""), 16)
+
+
+class SwitchConnection(MockConnection):
+    """Connection to a switch applying the flow messages sent to it to a flow table.
+
+    Only flow entries matching (or wildcarding) MAC addresses, the input port and the VLAN id are
+    kept, i.e. not the ones matching ARP or TCP/UDP frames, as
+    (priority, in_port, dl_vlan, mac_src, mac_dst) => (dl_vlan, out_port) of their actions, with
+    dl_vlan None if the VLAN id is wildcarded or left as is, of.OFP_VLAN_NONE if stripped.
+    """
+
+    def __init__(self, dpid):
+        super(SwitchConnection, self).__init__(dpid)
+        self.flows = {}
+        self.num_flow_mods = 0  # flow messages received
+
+    def handle_msg(self, msg_type, data):
+        if msg_type == of.OFPT_FLOW_MOD:
+            msg = of.ofp_flow_mod()
+            msg.unpack(data)
+            self.num_flow_mods += 1
+            self._flow_mod(msg)
+
+    def lookup(self, in_port, dl_vlan, mac_src, mac_dst):
+        """Get (dl_vlan, out_port) of a frame by the highest priority flow entry matching it.
+
+        Returns:
+            dl_vlan (int): VLAN id of the frame sent, of.OFP_VLAN_NONE if untagged
+            out_port (int): output port, None if no flow entry matches
+        """
+        best = None
+        for key, (set_vlan, out_port) in self.flows.iteritems():
+            if any(field not in (None, value)
+                   for field, value in zip(key[1:], (in_port, dl_vlan, mac_src, mac_dst))):
+                continue
+            if best is None or key[0] > best[0]:
+                best = (key[0], dl_vlan if set_vlan is None else set_vlan, out_port)
+        return (dl_vlan, None) if best is None else best[1:]
+
+    def _flow_mod(self, msg):
+        match = msg.match
+        if match.dl_type is not None:
+            return  # not a routing flow entry
+        key = (msg.priority, match.in_port, match.dl_vlan, eth_mac(match.dl_src),
+               eth_mac(match.dl_dst))
+
+        if msg.command in (of.OFPFC_ADD, of.OFPFC_MODIFY_STRICT):
+            set_vlan = out_port = None
+            for action in msg.actions:
+                if isinstance(action, of.ofp_action_vlan_vid):
+                    set_vlan = action.vlan_vid
+                elif isinstance(action, of.ofp_action_strip_vlan):
+                    set_vlan = of.OFP_VLAN_NONE
+                elif isinstance(action, of.ofp_action_output):
+                    out_port = action.port
+            self.flows[key] = (set_vlan, out_port)
+        elif msg.command == of.OFPFC_DELETE_STRICT:
+            self.flows.pop(key, None)
+        elif msg.command == of.OFPFC_DELETE:
+            for flow_key, (_, out_port) in self.flows.items():
+                if all(field is None or field == flow_field
+                       for field, flow_field in zip(key[1:], flow_key[1:])) and \
+                        msg.out_port in (of.OFPP_NONE, out_port):
+                    del self.flows[flow_key]
+
+
+class FlowTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = dcell_controller.FlowTable()
+        self.table.MERGE_SIZE = 4  # merge added flow entries often
+
+    def test_add_del(self):
+        table = self.table
+        table.add_flow(1, 2, 3, 4)
+        table.add_flow(1, 2, 3, 4)
+        table.add_flow(1, 2, 5, 4)
+        table.add_flow(1, 3, 2, 6)
+        table.add_flow(2, 2, 3, 7)
+        self.assertEqual(table.flow_port(1, 2, 3), 4)
+        self.assertEqual(table.flow_port(2, 2, 3), 7)
+        self.assertIsNone(table.flow_port(1, 3, 3))
+        self.assertEqual(table.flow_addrs(1), set([(2, 3), (2, 5), (3, 2)]))
+        self.assertEqual(table.flow_addrs(1, 6), set([(3, 2)]))
+
+        table.del_flow(1, 2, 3, 5)  # other port
+        self.assertEqual(table.flow_port(1, 2, 3), 4)
+        table.del_flow(1, 2, 3, 4)
+        self.assertIsNone(table.flow_port(1, 2, 3))
+        table.del_flow(1, 2, 5)
+        table.del_flow(1, out_port=6)
+        self.assertEqual(table.flows(1), [])
+        table.del_flow(2)
+        self.assertEqual(table.flows(2), [])
+        table.del_flow(3)  # unknown switch
+
+    def test_largest_fields(self):
+        max_mac, max_port = 2 ** 24 - 1, of.OFPP_MAX
+        self.table.add_flow(1, max_mac, max_mac, max_port)
+        self.table.add_flow(1, max_mac, max_mac - 1, 1)
+        self.table.add_flow(1, 1, max_mac, dcell_controller.DROP_PORT)
+        self.assertEqual(self.table.flow_port(1, max_mac, max_mac), max_port)
+        self.assertEqual(sorted(self.table.flows(1)),
+                         [(1, max_mac, 0), (max_mac, max_mac - 1, 1),
+                          (max_mac, max_mac, max_port)])
+
+    def test_random_ops(self):
+        # compare with a set of flow entries under random adds and deletes, across merges
+        rng = random.Random(0)
+        flows = set()
+        for _ in range(2000):
+            dpid, mac_src, mac_dst, port = [rng.randint(1, 3) for _ in range(4)]
+            op = rng.random()
+            if op < 0.6:
+                self.table.add_flow(dpid, mac_src, mac_dst, port)
+                flows.add((dpid, mac_src, mac_dst, port))
+            elif op < 0.8:
+                self.table.del_flow(dpid, mac_src, mac_dst, port)
+                flows.discard((dpid, mac_src, mac_dst, port))
+            elif op < 0.9:
+                self.table.del_flow(dpid, mac_src, mac_dst)
+                flows -= set(flow for flow in flows if flow[:3] == (dpid, mac_src, mac_dst))
+            else:
+                self.table.del_flow(dpid, out_port=port)
+                flows -= set(flow for flow in flows if flow[0] == dpid and flow[3] == port)
+            ports = [flow[3] for flow in flows if flow[:3] == (dpid, mac_src, mac_dst)]
+            self.assertEqual(self.table.flow_port(dpid, mac_src, mac_dst),
+                             min(ports) if ports else None)
+        for dpid in range(1, 4):
+            self.assertEqual(sorted(self.table.flows(dpid)),
+                             sorted(flow[1:] for flow in flows if flow[0] == dpid))
+
+    def test_dump_load(self):
+        for mac_dst in range(100, 0, -1):
+            self.table.add_flow(mac_dst % 3, 1, mac_dst, mac_dst % 5)
+        table = dcell_controller.FlowTable()
+        table.load(self.table.dump())
+        for dpid in range(3):
+            self.assertEqual(table.flows(dpid), self.table.flows(dpid))
+            self.assertEqual(table.flows(dpid), sorted(table.flows(dpid)))
+
+
+class RecordingConnection(MockConnection):
+    """Connection to a switch recording the messages sent to it."""
+
+    def __init__(self, dpid):
+        super(RecordingConnection, self).__init__(dpid)
+        self.sent = []
+
+    def handle_msg(self, msg_type, data):
+        self.sent.append(data)
+
+
+class ArpRepliesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.arp_replies = dcell_controller.ArpReplies(20)
+
+    def arp_request(self, mac_src, ip_src, ip_dst):
+        """Create an ARP request frame."""
+        arp_req = pkt.arp(opcode=pkt.arp.REQUEST, hwsrc=mac_src, protosrc=ip_src,
+                          protodst=ip_dst)
+        packet_eth = pkt.ethernet(src=mac_src, dst=pkt.ETHER_BROADCAST,
+                                  type=pkt.ethernet.ARP_TYPE)
+        packet_eth.payload = arp_req
+        return packet_eth
+
+    def check_reply(self, data, host, mac_src, ip_src, in_port):
+        """Check a packed ARP reply of a host to a requester."""
+        msg = of.ofp_packet_out()
+        msg.unpack(data)
+        self.assertEqual(msg.in_port, in_port)
+        self.assertEqual([action.port for action in msg.actions], [of.OFPP_IN_PORT])
+        packet_eth = pkt.ethernet(msg.data)
+        arp_resp = packet_eth.payload
+        self.assertEqual(arp_resp.opcode, pkt.arp.REPLY)
+        self.assertEqual((packet_eth.src, packet_eth.dst),
+                         (EthAddr(comm.mac_to_str(host)), mac_src))
+        self.assertEqual((arp_resp.hwsrc, arp_resp.protosrc),
+                         (EthAddr(comm.mac_to_str(host)), IPAddr(comm.IP_BASE + host)))
+        self.assertEqual((arp_resp.hwdst, arp_resp.protodst), (mac_src, ip_src))
+
+    def test_reply(self):
+        for host, requester, in_port in ((1, 2, 1), (20, 1, 3), (7, 7, of.OFPP_MAX)):
+            mac_src = EthAddr(comm.mac_to_str(requester))
+            ip_src = IPAddr(comm.IP_BASE + requester)
+            data = self.arp_replies.reply(IPAddr(comm.IP_BASE + host), mac_src, ip_src, in_port)
+            self.assertEqual(len(data), dcell_controller.ArpReplies.SIZE)
+            self.check_reply(data, host, mac_src, ip_src, in_port)
+
+    def test_reply_unknown_host(self):
+        mac_src, ip_src = EthAddr(comm.mac_to_str(1)), IPAddr(comm.IP_BASE + 1)
+        for host in (0, 21):
+            self.assertIsNone(self.arp_replies.reply(IPAddr(comm.IP_BASE + host), mac_src,
+                                                     ip_src, 1))
+
+    def test_switch_replies(self):
+        conn = RecordingConnection(3)
+        switch = dcell_controller.Switch(conn, self.arp_replies)
+        mac_src, ip_src = EthAddr(comm.mac_to_str(3)), IPAddr(comm.IP_BASE + 3)
+        for host in (5, 6):
+            packet_eth = self.arp_request(mac_src, ip_src, IPAddr(comm.IP_BASE + host))
+            ofp = of.ofp_packet_in(in_port=DCellWiring.HOST_PORT, data=packet_eth.pack())
+            switch._handle_PacketIn(PacketIn(conn, ofp))
+        self.assertEqual(len(conn.sent), 2)
+        self.check_reply(conn.sent[0], 5, mac_src, ip_src, DCellWiring.HOST_PORT)
+        self.check_reply(conn.sent[1], 6, mac_src, ip_src, DCellWiring.HOST_PORT)
+
+
+class DCellControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._config = dict((name, getattr(comm, name)) for name in CONFIG_NAMES)
+        self._dir = tempfile.mkdtemp()
+        comm.LINK_EVENT_WINDOW = 0
+        comm.LINK_FLAP_HALF_LIFE = 0
+        comm.AUDIT_INTERVAL = 0
+        comm.TOPO_FILE = None
+        comm.ROUTES_READY_FILE = os.path.join(self._dir, "routes_ready")
+
+    def tearDown(self):
+        for name, value in self._config.iteritems():
+            setattr(comm, name, value)
+        shutil.rmtree(self._dir)
+
+    def start(self, k, n, **config):
+        """Start a controller on a DCell_k with n hosts in each DCell_0 and connect all switches."""
+        comm.DCELL_K, comm.DCELL_N = k, n
+        for name, value in config.iteritems():
+            setattr(comm, name, value)
+        self.wiring = DCellWiring.build()
+        self.num_hosts = self.wiring.num_hosts
+        self.bad_ports = set()
+
+        self.openflow = MockOpenFlow()
+        core.components["openflow"] = self.openflow
+        self.controller = dcell_controller.Controller()
+        for dpid in range(1, self.wiring.num_switches + 1):
+            self.connect(SwitchConnection(dpid))
+
+    def restart(self):
+        """Start a new controller and connect all switches again, keeping their flow entries."""
+        conns = self.openflow.connections
+        self.openflow = MockOpenFlow()
+        core.components["openflow"] = self.openflow
+        self.controller = dcell_controller.Controller()
+        for dpid in range(1, self.wiring.num_switches + 1):
+            self.connect(conns[dpid])
+
+    def connect(self, conn):
+        """Connect a switch, clearing its flow entries first unless disabled as of_01 does."""
+        if self.openflow.clear_flows_on_connect:
+            conn.flows.clear()
+        self.openflow.connections[conn.dpid] = conn
+        self.controller._handle_openflow_ConnectionUp(ConnectionUp(conn, None))
+
+    def disconnect(self, dpid):
+        """Disconnect a switch."""
+        conn = self.openflow.connections.pop(dpid)
+        self.controller._handle_openflow_ConnectionDown(ConnectionDown(conn))
+        return conn
+
+    def link_event(self, added, dpid, port):
+        """Report the link on a switch port going up or down."""
+        peer, peer_port = self.wiring.peer(dpid, port)
+        for end in ((dpid, port), (peer, peer_port)):
+            if added:
+                self.bad_ports.discard(end)
+            else:
+                self.bad_ports.add(end)
+        event = LinkEvent(added, Link(dpid, port, peer, peer_port).uni, None)
+        self.controller._handle_openflow_discovery_LinkEvent(event)
+
+    def port_down(self, dpid, port):
+        """Report a switch port going down by PortStatus, without a link event."""
+        self.bad_ports.add((dpid, port))
+        desc = of.ofp_phy_port(port_no=port, state=of.OFPPS_LINK_DOWN)
+        ofp = of.ofp_port_status(reason=of.OFPPR_MODIFY, desc=desc)
+        self.controller._handle_openflow_PortStatus(
+            PortStatus(self.openflow.connections[dpid], ofp))
+
+    def wait_link_changes(self):
+        """Wait until the link state changes collected in the window are applied."""
+        while self.controller._rebuild_timer is not None:
+            time.sleep(0.01)
+        with self.controller._mutex_link_state:
+            pass  # being applied by the recoco thread
+
+    def delivered_pairs(self):
+        """Forward a frame between each pair of hosts, get the number of pairs delivered."""
+        hosts = range(1, self.num_hosts + 1)
+        return sum(1 for mac_src in hosts for mac_dst in hosts
+                   if mac_src != mac_dst and self.forward(mac_src, mac_dst) == DELIVERED)
+
+    def flow_stats_reply(self, dpid, stats):
+        """Reply to the flow stats request of the controller with given ofp_flow_stats."""
+        event = FlowStatsReceived(self.openflow.connections[dpid], [of.ofp_stats_reply()], stats)
+        self.controller._handle_openflow_FlowStatsReceived(event)
+
+    def forward(self, mac_src, mac_dst, hops=None):
+        """Forward a frame from its source host until it reaches the destination host.
+
+        Frames missing the flow table of a switch are sent to the controller and then forwarded
+        through the flow table again, as the controller does with OFPP_TABLE. Frames still
+        tagged when reaching the destination host are dropped by the host.
+
+        Args:
+            hops (list): (dpid, out_port) of each switch passed appended to it if not None
+        """
+        dpid, in_port, dl_vlan = mac_src, DCellWiring.HOST_PORT, of.OFP_VLAN_NONE
+        visited = set()
+        while (dpid, in_port, dl_vlan) not in visited:
+            visited.add((dpid, in_port, dl_vlan))
+            conn = self.openflow.connections[dpid]
+            out_vlan, out_port = conn.lookup(in_port, dl_vlan, mac_src, mac_dst)
+            if out_port is None:
+                ofp = of.ofp_packet_in(in_port=in_port, data=eth_frame(mac_src, mac_dst))
+                self.controller._handle_openflow_PacketIn(PacketIn(conn, ofp))
+                out_vlan, out_port = conn.lookup(in_port, dl_vlan, mac_src, mac_dst)
+
+            if out_port is None or (dpid, out_port) in self.bad_ports:
+                return DROPPED
+            if hops is not None:
+                hops.append((dpid, out_port))
+            if dpid == mac_dst and out_port == DCellWiring.HOST_PORT:
+                return DELIVERED if out_vlan == of.OFP_VLAN_NONE else DROPPED
+            (dpid, in_port), dl_vlan = self.wiring.peer(dpid, out_port), out_vlan
+        return LOOPED
+
+    def looped_pairs(self):
+        """Forward a frame between each pair of hosts, get the pairs whose frames loop."""
+        hosts = range(1, self.num_hosts + 1)
+        return [(mac_src, mac_dst) for mac_src in hosts for mac_dst in hosts
+                if mac_src != mac_dst and self.forward(mac_src, mac_dst) == LOOPED]
+
+    def test_reactive_aggregate_link_down(self):
+        self.start(1, 4, REACTIVE_ROUTING=True, AGGREGATE_FLOWS=True)
+        self.assertEqual(self.looped_pairs(), [])
+        self.link_event(False, 8, DCellWiring.MINI_PORT)
+        self.assertEqual(self.looped_pairs(), [])
+        self.link_event(True, 8, DCellWiring.MINI_PORT)
+        self.assertEqual(self.looped_pairs(), [])
+
+    def test_backup_port_down(self):
+        self.start(1, 4, BACKUP_FLOWS=True)
+        num_pairs = self.num_hosts * (self.num_hosts - 1)
+        # both ends of a level link report the port down before the link times out
+        port = self.wiring.level_port(3, 1)
+        peer, peer_port = self.wiring.peer(3, port)
+        self.port_down(3, port)
+        self.port_down(peer, peer_port)
+        self.assertEqual(self.delivered_pairs(), num_pairs)
+
+    def test_backup_transit_no_shadow(self):
+        self.start(1, 4, BACKUP_FLOWS=True)
+        self.link_event(False, 19, DCellWiring.MINI_PORT)
+        self.link_event(False, 3, self.wiring.level_port(3, 1))
+        # primary frames (e.g. from host 2 to 13 at mini switch 21) arriving on the input port of
+        # a backup flow entry follow their primary paths
+        routing = self.controller._routing
+        for mac_src in range(1, self.num_hosts + 1):
+            for mac_dst in range(1, self.num_hosts + 1):
+                hops = []
+                if mac_src == mac_dst or self.forward(mac_src, mac_dst, hops) != DELIVERED:
+                    continue
+                route = routing.route(comm.tuple_id(mac_src), comm.tuple_id(mac_dst))
+                self.assertEqual(tuple(hops), route)
+
+    def test_reactive_aggregate_link_flaps(self):
+        self.start(2, 2, REACTIVE_ROUTING=True, AGGREGATE_FLOWS=True)
+        rng = random.Random(0)
+        ports = [(dpid, port) for dpid, port in zip(*self.wiring.peers[1:].nonzero())]
+        self.assertEqual(self.looped_pairs(), [])
+        for dpid, port in rng.sample(ports, 4):
+            self.link_event(False, dpid + 1, port)
+            self.assertEqual(self.looped_pairs(), [])
+        for dpid, port in sorted(self.bad_ports):
+            if (dpid, port) in self.bad_ports:
+                self.link_event(True, dpid, port)
+        self.assertEqual(self.looped_pairs(), [])
+
+    def test_unreachable_pairs_dropped(self):
+        self.start(2, 2, AGGREGATE_FLOWS=True, BACKUP_FLOWS=True)
+        num_pairs = self.num_hosts * (self.num_hosts - 1)
+        # no path is found for some pairs (e.g. 19 to 35), their frames are dropped at the source
+        for dpid, port in ((6, 3), (36, 3), (33, DCellWiring.MINI_PORT)):
+            self.link_event(False, dpid, port)
+        self.assertEqual(self.looped_pairs(), [])
+        hops = []
+        self.assertEqual(self.forward(19, 35, hops), DROPPED)
+        self.assertEqual(hops, [])
+        for dpid, port in sorted(self.bad_ports):
+            if (dpid, port) in self.bad_ports:
+                self.link_event(True, dpid, port)
+        self.assertEqual(self.delivered_pairs(), num_pairs)
+
+    def test_link_event_window(self):
+        self.start(1, 4, LINK_EVENT_WINDOW=0.05)
+        num_pairs = self.num_hosts * (self.num_hosts - 1)
+        rebuilds = []
+        build_routes = self.controller._build_routes
+        self.controller._build_routes = lambda routes: (rebuilds.append(set(routes)),
+                                                        build_routes(routes))
+        link_routes = self.controller._link_routes
+
+        # a link flapping within the window ends up as it was, nothing is rebuilt
+        num_flow_mods = sum(conn.num_flow_mods for conn in self.openflow.connections.values())
+        for added in (False, True, False, True):
+            self.link_event(added, 3, self.wiring.level_port(3, 1))
+        self.wait_link_changes()
+        self.assertEqual(rebuilds, [set()])
+        self.assertEqual(sum(conn.num_flow_mods for conn in self.openflow.connections.values()),
+                         num_flow_mods)
+
+        # routes passing two links broken within the window are rebuilt once
+        links = [(3, self.wiring.level_port(3, 1)), (8, DCellWiring.MINI_PORT)]
+        routes = set()
+        for dpid, port in links:
+            routes.update(link_routes[self.controller._routing.port_link(dpid, port)])
+            self.link_event(False, dpid, port)
+        self.assertEqual(len(rebuilds), 1)
+        self.wait_link_changes()
+        self.assertEqual(rebuilds[1:], [routes])
+        self.assertEqual(self.looped_pairs(), [])
+
+        for dpid, port in links:
+            self.link_event(True, dpid, port)
+        self.wait_link_changes()
+        self.assertEqual(self.delivered_pairs(), num_pairs)
+
+    def test_link_flap_damping(self):
+        self.start(1, 4, LINK_FLAP_HALF_LIFE=10, LINK_FLAP_SUPPRESS=3, LINK_FLAP_REUSE=1)
+        num_pairs = self.num_hosts * (self.num_hosts - 1)
+        port = self.wiring.level_port(3, 1)
+        link = self.controller._routing.port_link(3, port)
+        routing = self.controller._routing
+        scheduled = []  # (delay, callback, args) of the reuse timers
+        call_delayed = core.callDelayed
+        core.callDelayed = lambda delay, callback, *args: scheduled.append((delay, callback, args))
+        try:
+            # both directions of the link report each failure, penalized once
+            for _ in range(3):
+                self.link_event(False, 3, port)
+                self.link_event(False, 3, port)
+                self.link_event(True, 3, port)
+            self.assertNotIn(link, self.controller._bad_links)
+            self.assertAlmostEqual(self.controller._flap_penalty(link), 3, places=2)
+
+            # suppressed once the penalty exceeds LINK_FLAP_SUPPRESS, routes avoid the link
+            self.link_event(False, 3, port)
+            self.link_event(True, 3, port)
+            self.assertIn(link, self.controller._damped_links)
+            self.assertIn(link, self.controller._bad_links)
+            self.assertNotIn((3, port), routing.route(comm.tuple_id(3), comm.tuple_id(13)))
+            self.assertEqual(self.delivered_pairs(), num_pairs)
+
+            # reused once the penalty decays to LINK_FLAP_REUSE, after 2 half lives
+            self.assertEqual(len(scheduled), 1)
+            self.assertAlmostEqual(scheduled[0][0], 20, delta=0.5)
+            penalty, last_flap = self.controller._link_penalties[link]
+            self.controller._link_penalties[link] = (penalty, last_flap - 15)
+            delay, callback, args = scheduled.pop()
+            callback(*args)  # flapped again while damped
+            self.assertIn(link, self.controller._damped_links)
+            self.assertAlmostEqual(scheduled[0][0], 5, delta=0.5)
+            self.controller._link_penalties[link] = (penalty, last_flap - 20)
+            delay, callback, args = scheduled.pop()
+            callback(*args)
+            self.assertNotIn(link, self.controller._damped_links)
+            self.assertNotIn(link, self.controller._bad_links)
+            self.assertIn((3, port), routing.route(comm.tuple_id(3), comm.tuple_id(13)))
+            self.assertEqual(self.delivered_pairs(), num_pairs)
+        finally:
+            core.callDelayed = call_delayed
+
+    def test_multipath_spreads_flows(self):
+        self.start(1, 4, MULTIPATH_ROUTING=True, MULTIPATH_NUM_PATHS=4)
+        conn = self.openflow.connections[1]
+        tpl_src, tpl_dst = comm.tuple_id(1), comm.tuple_id(13)
+        paths = self.controller._routing.multipath_route(tpl_src, tpl_dst, 4)
+        self.assertEqual(len(paths), 4)
+
+        # TCP flows of the pair (first frames sent to the controller) are spread by 5-tuple
+        flow_hops = self.controller._flow_hops
+        for port_src in range(10000, 10064):
+            ofp = of.ofp_packet_in(in_port=DCellWiring.HOST_PORT,
+                                   data=tcp_frame(1, 13, port_src, 80))
+            self.controller._handle_openflow_PacketIn(PacketIn(conn, ofp))
+        self.assertEqual(len(flow_hops), 64)
+        self.assertEqual(set(flow_hops.itervalues()), set(paths))
+
+        # the same flow keeps its path, flows through a broken link are removed
+        five_tuple, hops = next(flow_hops.iteritems())
+        ofp = of.ofp_packet_in(in_port=DCellWiring.HOST_PORT,
+                               data=tcp_frame(1, 13, five_tuple[3], five_tuple[4]))
+        self.controller._handle_openflow_PacketIn(PacketIn(conn, ofp))
+        self.assertEqual(flow_hops[five_tuple], hops)
+        dpid, port = hops[1]
+        self.link_event(False, dpid, port)
+        link = self.controller._routing.port_link(dpid, port)
+        self.assertTrue(flow_hops)
+        self.assertNotIn(hops, flow_hops.values())
+        self.assertFalse(self.controller._link_flows[link])
+
+    def test_arp_flow(self):
+        self.start(1, 4)
+        sent = []
+        self.controller._send = lambda dpid, msg: sent.append((dpid, msg))
+        self.controller._add_arp_flow(3)
+        (dpid, msg), = sent
+        self.assertEqual(dpid, 3)
+        self.assertEqual((msg.match.in_port, msg.match.dl_type, msg.match.nw_proto),
+                         (DCellWiring.HOST_PORT, pkt.ethernet.ARP_TYPE, pkt.arp.REQUEST))
+        msg.pack()  # fills in the number of bits of register actions
+
+        # apply the actions to the fields of an ARP request from host 3 for host 13
+        fields = {nx.NXM_OF_ETH_SRC: 3, nx.NXM_OF_ETH_DST: 0xFFFFFFFFFFFF, nx.NXM_NX_ARP_SHA: 3,
+                  nx.NXM_NX_ARP_THA: 0, nx.NXM_OF_ARP_SPA: comm.IP_BASE + 3,
+                  nx.NXM_OF_ARP_TPA: comm.IP_BASE + 13, nx.NXM_OF_ARP_OP: pkt.arp.REQUEST,
+                  nx.NXM_NX_REG0: 0}
+        for action in msg.actions[:-1]:
+            if isinstance(action, nx.nx_reg_move):
+                value, ofs = fields[action.src] >> action.src_ofs, action.dst_ofs
+            else:
+                value, ofs = action.value, action.offset
+            mask = (1 << action.nbits) - 1
+            fields[action.dst] = (fields[action.dst] & ~(mask << ofs)) | ((value & mask) << ofs)
+        self.assertEqual(msg.actions[-1].port, of.OFPP_IN_PORT)
+        self.assertEqual(fields, {
+            nx.NXM_OF_ETH_SRC: 13, nx.NXM_OF_ETH_DST: 3, nx.NXM_NX_ARP_SHA: 13,
+            nx.NXM_NX_ARP_THA: 3, nx.NXM_OF_ARP_SPA: comm.IP_BASE + 13,
+            nx.NXM_OF_ARP_TPA: comm.IP_BASE + 3, nx.NXM_OF_ARP_OP: pkt.arp.REPLY,
+            nx.NXM_NX_REG0: comm.IP_BASE + 13})
+
+    def test_audit_repairs_flows(self):
+        self.start(1, 4)
+        self.openflow.connections[1].flows.clear()
+        self.controller._request_flow_stats(1)
+        self.flow_stats_reply(1, [])
+        self.assertEqual(self.controller._audit_metrics["replies"], 1)
+        self.assertTrue(all(self.forward(1, mac_dst) == DELIVERED
+                            for mac_dst in range(2, self.num_hosts + 1)))
+
+    def test_audit_discards_stale_reply(self):
+        self.start(1, 4)
+        conn = self.openflow.connections[1]
+        self.controller._request_flow_stats(1)
+        # routes from host 1 are rebuilt after the request, the reply misses the new flow entries
+        self.link_event(False, 1, self.wiring.level_port(1, 1))
+        flows = dict(conn.flows)
+        self.flow_stats_reply(1, [])
+        self.assertEqual(conn.flows, flows)
+        self.assertEqual(self.controller._audit_metrics["stale"], 1)
+        self.assertEqual(self.controller._audit_metrics["replies"], 0)
+        self.assertIn(1, self.controller._stats_requests)
+
+    def test_warm_restart_keeps_flows(self):
+        self.start(1, 4, BACKUP_FLOWS=True, AGGREGATE_FLOWS=True, SNAPSHOT_INTERVAL=3600,
+                   SNAPSHOT_FILE=os.path.join(self._dir, "snapshot"))
+        self.link_event(False, 3, self.wiring.level_port(3, 1))
+        self.controller._save_snapshot()
+        conns = self.openflow.connections.values()
+        num_flow_mods = sum(conn.num_flow_mods for conn in conns)
+
+        self.restart()
+        self.assertFalse(self.openflow.clear_flows_on_connect)
+        self.assertTrue(self.controller._warm)
+        self.assertEqual(sum(conn.num_flow_mods for conn in conns), num_flow_mods)
+        num_pairs = self.num_hosts * (self.num_hosts - 1)
+        self.assertEqual(self.delivered_pairs(), num_pairs)
+
+    def test_reconnect_pushes_flows(self):
+        self.start(1, 4, BACKUP_FLOWS=True, AGGREGATE_FLOWS=True, SNAPSHOT_INTERVAL=3600,
+                   SNAPSHOT_FILE=os.path.join(self._dir, "snapshot"))
+        self.controller._save_snapshot()
+        self.restart()
+        num_pairs = self.num_hosts * (self.num_hosts - 1)
+        # switches restarted after the warm restart have lost their flow entries, which are
+        # pushed again when they connect instead of after their flow stats are reconciled
+        for dpid in (3, self.num_hosts + 1):
+            conn = self.disconnect(dpid)
+            conn.flows.clear()
+            self.connect(conn)
+            self.assertEqual(self.delivered_pairs(), num_pairs)
+
+    def test_route_workers(self):
+        min_routes = dcell_controller.PARALLEL_MIN_ROUTES
+        dcell_controller.PARALLEL_MIN_ROUTES = 1
+        try:
+            self.start(1, 4, ROUTE_WORKERS=2, BACKUP_FLOWS=True)
+            # two link changes while the routes of the first one are computed by the workers
+            self.link_event(False, 3, self.wiring.level_port(3, 1))
+            self.link_event(False, 8, DCellWiring.MINI_PORT)
+            while self.controller._route_tasks:
+                time.sleep(0.01)  # results are installed by the recoco thread
+            self.assertEqual(self.looped_pairs(), [])
+            self.assertEqual(self.delivered_pairs(), self.num_hosts * (self.num_hosts - 1))
+        finally:
+            dcell_controller.PARALLEL_MIN_ROUTES = min_routes
+            self.controller._stop_pool()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# pylint: disable=missing-docstring,invalid-name
+
+"""Tests of DCellRouting paths against the DCell wiring."""
+
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(TEST_DIR, "..", "..", "..", "ext"))
+
+import comm
+from routing import DCellRouting
+from wiring import DCellWiring
+
+
+class DCellRoutingTest(unittest.TestCase):
+
+    def setUp(self):
+        self._config = (comm.DCELL_K, comm.DCELL_N)
+
+    def tearDown(self):
+        comm.DCELL_K, comm.DCELL_N = self._config
+
+    def start(self, k, n, bad_links=()):
+        """Create a DCellRouting on a DCell_k with n hosts in each DCell_0."""
+        comm.DCELL_K, comm.DCELL_N = k, n
+        self.wiring = DCellWiring.build()
+        self.num_hosts = self.wiring.num_hosts
+        self.bad_links = set(bad_links)
+        self.routing = DCellRouting(self.bad_links, wiring=self.wiring)
+
+    def link(self, dpid, port):
+        """Get the link connected to a switch port."""
+        return self.routing.port_link(dpid, port)
+
+    def check_path(self, mac_src, mac_dst, hops):
+        """Check that a path leads from the source host to the destination host over good links."""
+        self.assertEqual(hops[0][0], mac_src)
+        self.assertEqual(hops[-1], (mac_dst, DCellWiring.HOST_PORT))
+        for (dpid, out_port), (next_dpid, _) in zip(hops, hops[1:]):
+            self.assertEqual(self.wiring.peer(dpid, out_port)[0], next_dpid)
+            self.assertNotIn(self.link(dpid, out_port), self.bad_links)
+        self.assertEqual(len(set(dpid for dpid, _ in hops)), len(hops))
+
+    def test_multipath_route(self):
+        self.start(1, 4)
+        for mac_src in range(1, self.num_hosts + 1):
+            for mac_dst in range(1, self.num_hosts + 1):
+                if mac_src == mac_dst:
+                    continue
+                tpl_src, tpl_dst = comm.tuple_id(mac_src), comm.tuple_id(mac_dst)
+                paths = self.routing.multipath_route(tpl_src, tpl_dst, 4)
+                self.assertEqual(paths[0], self.routing.route(tpl_src, tpl_dst))
+                if tpl_src[0] == tpl_dst[0]:
+                    self.assertEqual(len(paths), 1)  # single path within a DCell_0
+                    continue
+
+                # the first path passes the middle link, the others detour through distinct
+                # proxy DCell_0s
+                self.assertEqual(len(paths), 4)
+                self.assertEqual(len(set(paths)), len(paths))
+                for hops in paths:
+                    self.check_path(mac_src, mac_dst, hops)
+                mid_links = [set(self.link(dpid, port) for dpid, port in hops[:-1]
+                                 if dpid <= self.num_hosts and port > DCellWiring.MINI_PORT)
+                             for hops in paths]
+                for links in mid_links[1:]:
+                    self.assertFalse(links & mid_links[0])
+
+    def test_multipath_route_bad_links(self):
+        self.start(2, 2)
+        tpl_src, tpl_dst = comm.tuple_id(1), comm.tuple_id(self.num_hosts)
+        paths = self.routing.multipath_route(tpl_src, tpl_dst, 3)
+        self.assertEqual(len(paths), 3)
+
+        # paths avoid broken links, fewer paths are left
+        hops = paths[1]
+        link = self.link(*hops[len(hops) // 2])
+        self.assertIsNotNone(link)
+        self.bad_links.add(link)
+        self.routing.clear()
+        for num_paths in (1, 3, 8):
+            paths = self.routing.multipath_route(tpl_src, tpl_dst, num_paths)
+            self.assertTrue(1 <= len(paths) <= num_paths)
+            self.assertNotIn(hops, paths)
+            for path in paths:
+                self.check_path(1, self.num_hosts, path)
+
+    def test_rack_route(self):
+        self.start(1, 4)
+        mini_link = self.link(2, DCellWiring.MINI_PORT)
+        level_port = self.wiring.level_port(2, 1)
+        peer, peer_port = self.wiring.peer(2, level_port)
+        self.bad_links.add(mini_link)
+
+        # a host switch cut off from its mini switch is left and reached over its level-1 link
+        for mac_dst in (3, 13):
+            hops = self.routing.route(comm.tuple_id(2), comm.tuple_id(mac_dst))
+            self.check_path(2, mac_dst, hops)
+            self.assertEqual(hops[0], (2, level_port))
+        for mac_src in (3, 13):
+            hops = self.routing.route(comm.tuple_id(mac_src), comm.tuple_id(2))
+            self.check_path(mac_src, 2, hops)
+            self.assertEqual(hops[-2:], ((peer, peer_port), (2, DCellWiring.HOST_PORT)))
+
+        # the route depends on both links, and is restored once the mini switch link recovers
+        links = self.routing.route_links(comm.tuple_id(2), comm.tuple_id(3))
+        self.assertIn(mini_link, links)
+        self.assertIn(self.link(2, level_port), links)
+        self.bad_links.discard(mini_link)
+        self.routing.invalidate(mini_link)
+        mini = self.wiring.peer(2, DCellWiring.MINI_PORT)[0]
+        self.assertEqual(self.routing.route(comm.tuple_id(2), comm.tuple_id(3)),
+                         ((2, DCellWiring.MINI_PORT), (mini, self.wiring.mini_port(3)),
+                          (3, DCellWiring.HOST_PORT)))
+
+    def test_rack_route_both_ends(self):
+        self.start(1, 4)
+        self.bad_links.update((self.link(2, DCellWiring.MINI_PORT),
+                               self.link(3, DCellWiring.MINI_PORT)))
+        hops = self.routing.route(comm.tuple_id(2), comm.tuple_id(3))
+        self.check_path(2, 3, hops)
+        self.assertEqual(hops[0], (2, self.wiring.level_port(2, 1)))
+        self.assertEqual(hops[-2][0], self.wiring.peer(3, self.wiring.level_port(3, 1))[0])
+
+    def test_rack_route_no_path(self):
+        self.start(1, 4)
+        # the level-1 link is broken as well
+        self.bad_links.update((self.link(2, DCellWiring.MINI_PORT),
+                               self.link(2, self.wiring.level_port(2, 1))))
+        self.assertIsNone(self.routing.route(comm.tuple_id(2), comm.tuple_id(3)))
+        self.assertIsNone(self.routing.route(comm.tuple_id(13), comm.tuple_id(2)))
+
+        # a DCell_0 has no level-1 link to reroute over
+        self.start(0, 4)
+        self.bad_links.add(self.link(2, DCellWiring.MINI_PORT))
+        self.assertIsNone(self.routing.route(comm.tuple_id(2), comm.tuple_id(3)))
+        self.assertIsNotNone(self.routing.route(comm.tuple_id(1), comm.tuple_id(3)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# pylint: disable=missing-docstring,invalid-name
+
+"""Tests of the DCell wiring shared by the Mininet topology and the controller."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(TEST_DIR, "..", "..", "..", "ext"))
+
+import numpy as np
+
+from wiring import DCellWiring
+
+# DCell sizes (k, n) to test
+SIZES = [(1, 2), (1, 4), (2, 2), (2, 3)]
+
+
+class DCellWiringTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.path = os.path.join(self._dir, "topo")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_save_load(self):
+        for k, n in SIZES:
+            wiring = DCellWiring.build(k, n)
+            wiring.save(self.path)
+            loaded = DCellWiring.load(self.path, k, n)
+            self.assertIsNotNone(loaded)
+            self.assertEqual((loaded.num_hosts, loaded.num_switches),
+                             (wiring.num_hosts, wiring.num_switches))
+            for name in ("peers", "peer_ports", "tuple_ids", "links", "level_ports"):
+                self.assertTrue(np.array_equal(getattr(loaded, name), getattr(wiring, name)),
+                                "{} of DCell ({}, {})".format(name, k, n))
+
+    def test_ports(self):
+        for k, n in SIZES:
+            wiring = DCellWiring.build(k, n)
+            for host_id in range(1, wiring.num_hosts + 1):
+                self.assertEqual(wiring.level_port(host_id, 0), DCellWiring.MINI_PORT)
+                mini, mini_port = wiring.peer(host_id, DCellWiring.MINI_PORT)
+                self.assertGreater(mini, wiring.num_hosts)
+                self.assertEqual(wiring.mini_port(host_id), mini_port)
+                self.assertEqual(wiring.peer(mini, mini_port), (host_id, DCellWiring.MINI_PORT))
+                self.assertEqual(wiring.peer(host_id, DCellWiring.HOST_PORT), (0, 0))
+                for level in range(1, k + 1):
+                    port = wiring.level_port(host_id, level)
+                    peer, peer_port = wiring.peer(host_id, port)
+                    self.assertTrue(0 < peer <= wiring.num_hosts)
+                    self.assertEqual(wiring.level_port(peer, level), peer_port)
+
+    def test_load_mismatch(self):
+        self.assertIsNone(DCellWiring.load(self.path, 1, 4))  # missing file
+        DCellWiring.build(1, 4).save(self.path)
+        self.assertIsNone(DCellWiring.load(self.path, 2, 2))
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 4)
+        self.assertIsNone(DCellWiring.load(self.path, 1, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()